@@ -0,0 +1,194 @@
+#pylint: disable=C0103,R0913
+# -*- coding: utf-8 -*-
+"""
+Calibration of the bus voltage correction parameters Vt and Rvbus of the INA260
+power meter from the internal and external voltage readings of a voltage ramp
+(see VoltageCalibration.py and VoltageCalibration.csv)
+"""
+
+import os
+import json
+import hashlib
+import collections
+from math import sqrt
+import numpy as np #pylint: disable=E0401
+
+#Result of a calibration fit. <Vt> and <Rvbus> are the calibrated parameters,
+#<outliers> and <clamped> the row indices of the dataset rejected from the fit,
+#<rms> the RMS deviation of the ratio external/internal voltage of the remaining rows
+#and <key> the hash of the dataset and fit settings used for the result cache
+CalibrationResult = collections.namedtuple('CalibrationResult', \
+                                           ['Vt', 'Rvbus', 'outliers', 'clamped', 'rms', 'key'])
+
+def model(internal, Vtm, Rvbusm, Rdiv1, Rvbus, Vt):
+    """
+    Ratio of external to internal voltage for the internally measured voltages
+    <internal> (array), which have been taken with the parameters <Rdiv1>, <Rvbus>
+    and <Vt>, if the true parameters are <Vtm> and <Rvbusm>
+    (See Mathematica Input deck SystemSimulation.nb)
+    """
+    internal = np.asarray(internal, dtype=np.float64)
+    return ((Rvbus * (Rdiv1 + Rvbusm) * (internal - Vt)) / ((Rdiv1 + Rvbus) * Rvbusm) + Vtm) \
+        / internal
+
+def _lstsq(internal, ratio, Rdiv1, Rvbus, Vt):
+    """
+    Ordinary (unweighted) least squares fit of the model to <ratio>. The model is
+    linear in Vtm and 1/Rvbusm, thus the fit is solved in closed form. Returns Vtm
+    and Rvbusm
+    """
+    divided = Rvbus / (Rdiv1 + Rvbus) * (internal - Vt) / internal
+    design = np.column_stack((1.0 / internal, divided * Rdiv1))
+    (Vtm, invRvbusm), _, _, _ = np.linalg.lstsq(design, ratio - divided, rcond=None)
+    return Vtm, 1.0 / invRvbusm
+
+def datasetkey(data, Rdiv1, Rvbus, Vt, threshold):
+    """
+    Returns the SHA-256 hash of the dataset <data> and the fit settings
+    """
+    digest = hashlib.sha256(np.ascontiguousarray(data, dtype=np.float64).tobytes())
+    digest.update(np.array([Rdiv1, Rvbus, Vt, threshold], dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+def fit(data, Rdiv1, Rvbus, Vt, threshold=3.5, cache=None):
+    """
+    Fits the calibration parameters to the rows (setpoint, internal voltage, external
+    voltage) of <data>, taken with the parameters <Rdiv1>, <Rvbus> and <Vt>.
+    Rows whose ratio external/internal voltage deviates more than <threshold> robust
+    standard deviations (scaled median absolute deviation) from the model are
+    rejected and the fit is repeated until the set of rows is stable. Rejected rows
+    at the upper end of the ramp with a too high ratio are reported as clamped by
+    the input protection of the sensing circuit.
+    If <cache> is the name of a JSON file, results are stored there by the hash of
+    dataset and settings and are returned without refitting for unchanged data.
+    Returns a CalibrationResult tuple. Raises ValueError if <data> has less than
+    three rows, since the two parameters and the spread can not be estimated then
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim != 2 or data.shape[1] < 3 or len(data) < 3:
+        raise ValueError("Calibration fit needs at least 3 rows (setpoint, internal voltage, "
+                         "external voltage), got data of shape {}".format(data.shape))
+    key = datasetkey(data, Rdiv1, Rvbus, Vt, threshold)
+    results = {}
+    if cache is not None and os.path.isfile(cache):
+        with open(cache, 'r') as f:
+            results = json.load(f)
+        if key in results:
+            return CalibrationResult(**results[key])
+    internal = data[:, 1]
+    ratio = data[:, 2] / internal
+    inliers = np.ones(len(data), dtype=bool)
+    for _ in range(len(data)):
+        Vtm, Rvbusm = _lstsq(internal[inliers], ratio[inliers], Rdiv1, Rvbus, Vt)
+        residuals = ratio - model(internal, Vtm, Rvbusm, Rdiv1, Rvbus, Vt)
+        sigma = 1.4826 * np.median(np.abs(residuals[inliers] - np.median(residuals[inliers])))
+        accepted = np.abs(residuals) <= threshold * max(sigma, np.finfo(float).eps)
+        if np.array_equal(accepted, inliers) or accepted.sum() < 3:
+            break
+        inliers = accepted
+    rejected = np.flatnonzero(~inliers)
+    top = internal[inliers].max()
+    isclamped = (residuals[rejected] > 0) & (internal[rejected] > top)
+    result = CalibrationResult(float(Vtm), float(Rvbusm), rejected[~isclamped].tolist(), \
+                               rejected[isclamped].tolist(), \
+                               float(np.sqrt(np.mean(residuals[inliers]**2))), key)
+    if cache is not None:
+        results[key] = result._asdict()
+        with open(cache, 'w') as f:
+            json.dump(results, f, indent=4)
+    return result
+
+class CorrectionTable:
+    """
+    Per-tap correction of the bus voltage decoded by the INA260 power meter. Each tap
+    (relay word) gets a fixed factor, the ratio external/internal voltage measured at
+    the tap. The ratio was measured with averaged readings at the operating voltage of
+    the tap, thus the factor scales all samples taken at this tap alike and does not
+    vary along the waveform. Taps without valid reading get the ratio of the straight
+    line fitted over the internal voltages of their range (coil configuration).
+    The factor of the active relay word is handed to the meter
+    (INA260Controller.correction), e.g. by VoltageLadder.switch().
+    The ranges are taken from <data> in the order of <ladders>, a new range starts
+    where the setpoint decreases. The readings have been taken with <Rdiv1>, <Rvbus>
+    and <Vt>. If the meter uses the parameters of the CalibrationResult <calibrated>
+    instead, the internal voltages are converted to them first, thus the table
+    corrects the residual deviation of the calibrated meter.
+
+    data...... Rows (setpoint, internal voltage, external voltage) of the ramp
+    ladders... VoltageLadder objects of the ranges
+    exclude... Row indices not used, e.g. the outliers and clamped rows of the fit
+    scale..... Factor between the internal voltage of <data> and the voltage decoded
+               by the meter (sqrt(2) for the effective voltage of the single rectifier)
+    mainsmask. Bit mask of the mains pins ignored in the relay words
+    """
+
+    def __init__(self, data, ladders, Rdiv1, Rvbus, Vt, calibrated=None, exclude=(), \
+                 scale=sqrt(2), mainsmask=0x0001):
+        data = np.asarray(data, dtype=np.float64)
+        self.__mainsmask = mainsmask
+        internal = data[:, 1] / scale
+        if calibrated is not None:
+            fvdiv = Rvbus / (Rdiv1 + Rvbus)
+            fvdivcal = calibrated.Rvbus / (Rdiv1 + calibrated.Rvbus)
+            internal = (internal - Vt) * fvdiv / fvdivcal + calibrated.Vt
+        ratio = data[:, 2] / scale / internal
+        starts = [0] + (np.flatnonzero(np.diff(data[:, 0]) < 0) + 1).tolist() + [len(data)]
+        assert len(starts) - 1 == len(ladders), \
+            "Data contains {} ranges but {} ladders are given".format(len(starts) - 1, len(ladders))
+        used = np.ones(len(data), dtype=bool)
+        used[list(exclude)] = False
+        self.__factors = {}
+        for ladder, first, stop in zip(ladders, starts[:-1], starts[1:]):
+            rows = np.arange(first, stop)
+            valid = rows[used[rows]]
+            assert len(valid) >= 2, "Each range needs at least two valid readings"
+            slope, offset = np.polyfit(internal[valid], ratio[valid], 1)
+            for row in rows:
+                factor = ratio[row] if used[row] else offset + slope * internal[row]
+                self.__factors[ladder.word(data[row, 0])] = float(factor)
+
+    @property
+    def words(self):
+        """
+        List of the relay words with correction factor
+        """
+        return list(self.__factors.keys())
+
+    def __getitem__(self, word):
+        """
+        Returns the correction factor of the relay word <word> or None if there is
+        no factor for it
+        """
+        return self.__factors.get(word & ~self.__mainsmask)
+
+    def apply(self, word, voltages):
+        """
+        Returns the corrected voltages of the array <voltages> measured with relay word <word>
+        """
+        voltages = np.asarray(voltages, dtype=np.float64)
+        factor = self[word]
+        if factor is None:
+            return voltages
+        return voltages * factor
+
+    def save(self, filename):
+        """
+        Writes the factors into the JSON file <filename>
+        """
+        with open(filename, 'w') as f:
+            json.dump({"mainsmask": self.__mainsmask, \
+                       "factors": {"0x{:04X}".format(word): factor \
+                                   for word, factor in self.__factors.items()}}, f, indent=4)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads the factors from the JSON file <filename> written by save()
+        """
+        with open(filename, 'r') as f:
+            content = json.load(f)
+        table = cls.__new__(cls)
+        table.__mainsmask = content["mainsmask"]
+        table.__factors = {int(word, 16): float(factor) \
+                           for word, factor in content["factors"].items()}
+        return table
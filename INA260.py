@@ -10,7 +10,20 @@ import os
 import time
 import struct
 import json
-import smbus #pylint: disable=E0401
+import contextlib
+import asyncio
+import collections
+import functools
+import threading
+try:
+    #smbus2 is a drop-in replacement for smbus which additionally supports combined
+    #I2C transactions (i2c_rdwr) used for reading several registers at once
+    import smbus2 as smbus #pylint: disable=E0401
+    from smbus2 import i2c_msg #pylint: disable=E0401
+except ImportError:
+    import smbus #pylint: disable=E0401
+    i2c_msg = None
+import numpy as np #pylint: disable=E0401
 import RPi.GPIO as GPIO #pylint: disable=E0401
 
 PCA_AUTOINCREMENT_OFF = 0x00
@@ -58,10 +71,26 @@ OVF = 2
 APOL = 1
 LEN = 0
 
+#Masks of the writable bits of the registers which are held in a shadow copy.
+#The self-clearing reset bit of the configuration register and the read-only flag
+#bits of the mask/enable register are not part of the shadow copy
+SHADOW_MASK = {REG_CONFIG: 0x7FFF, REG_MASK_ENABLE: 0xFC03}
+
 A_per_Bit = 1.25 / 1000
 V_per_Bit = 1.25 / 1000
 W_per_Bit = 10.0 / 1000
 
+def _buslocked(method):
+    """
+    Decorator holding the bus lock of the INA260Controller during <method>, thus its
+    register accesses are not interleaved with accesses of other threads
+    """
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.buslock:
+            return method(self, *args, **kwargs)
+    return locked
+
 class INA260Controller:
     """
     Driver Class for TI INA260 Controller
@@ -95,6 +124,13 @@ class INA260Controller:
                calculating the measured voltage when a series resistor is used.
     Vt........ Threshold voltage of rectifier diode to compensate for voltage loss
                at the very low current levels running through the voltage divider
+    The attribute correction can hold the correction factor of the active transformer
+    tap (see Calibration.CorrectionTable), which is applied to all decoded voltages.
+
+    The writable configuration and mask/enable registers are held in a write-through
+    shadow copy, thus changing a register field needs just a single write access.
+    All register accesses hold the reentrant bus lock (buslock), thus the meter can be
+    used from several threads, e.g. while an INA260Sampler is running.
     """
 
     def __init__(self, address=0x40, channel=1, alertpin=None, avg=1, vbusct=1100, ishct=1100, \
@@ -140,6 +176,12 @@ class INA260Controller:
                 Vt=attrs['Vt']
         self.i2c_channel = channel
         self.bus = smbus.SMBus(self.i2c_channel)
+        self.__buslock = threading.RLock()
+        self.__shadow = {}
+        self.__verify = False
+        self.__pointer = None
+        self.__fastread = 0 # Number of active fastread contexts
+        self.__fastmsg = None if i2c_msg is None else i2c_msg.read(address, 2)
         self.address = address
         self.__alertpin = alertpin
         if alertpin is not None:
@@ -152,12 +194,8 @@ class INA260Controller:
         else:
             self.__gpiocleanupneeded = False
         self.__alertcallback = alertcallback
-        self.avg = avg
-        self.vbusct = vbusct
-        self.ishct = ishct
-        self.meascont = meascont
-        self.measv = measv
-        self.measi = measi
+        self.configure(avg=avg, vbusct=vbusct, ishct=ishct, meascont=meascont, \
+                       measv=measv, measi=measi)
         self.alert = alert
         self.alertpol = alertpol
         self.alertlatch = alertlatch
@@ -168,6 +206,7 @@ class INA260Controller:
         self.__rvbus = Rvbus
         self.__vt = Vt
         self.__fvdiv = Rvbus / (Rdiv1 + Rvbus) # Voltage divider factor Vbus/Vmeas
+        self.__correction = None # Per-tap correction factor
 
     def WriteConfig(self, key, val, config='Automatic'):
         """
@@ -187,6 +226,49 @@ class INA260Controller:
             json.dump(data, f, indent=4)
             f.truncate()
 
+    @_buslocked
+    def configure(self, avg=None, vbusct=None, ishct=None, meascont=None, measv=None, \
+                  measi=None):
+        """
+        Changes the measurement settings of the configuration register with a single
+        write access. Each write into the configuration register restarts the
+        conversion, thus changing several settings at once yields just one restart and
+        a deterministic timing of the first valid sample. Settings which are None are
+        kept. The parameters are the same as described for the class.
+        """
+        creg = self._cached(REG_CONFIG)
+        if avg is not None:
+            assert (avg in AVG), "avg is not in allowed list of values: {}".format(AVG)
+            creg = self.__setbits(creg, [AVG0, AVG1, AVG2], AVG.index(avg))
+        if vbusct is not None:
+            assert (vbusct in CT), "vbusct is not in allowed list of values: {}".format(CT)
+            creg = self.__setbits(creg, [VBUSCT0, VBUSCT1, VBUSCT2], CT.index(vbusct))
+        if ishct is not None:
+            assert (ishct in CT), "ishct is not in allowed list of values: {}".format(CT)
+            creg = self.__setbits(creg, [ISHCT0, ISHCT1, ISHCT2], CT.index(ishct))
+        if meascont is not None:
+            assert (meascont in [True, False]), "meascont is not boolean"
+            creg = self.__setbits(creg, [MODE3], meascont)
+        if measv is not None:
+            assert (measv in [True, False]), "measv is not boolean"
+            creg = self.__setbits(creg, [MODE2], measv)
+        if measi is not None:
+            assert (measi in [True, False]), "measi is not boolean"
+            creg = self.__setbits(creg, [MODE1], measi)
+        self._write(REG_CONFIG, creg)
+        if avg is not None:
+            self.__avg = avg
+        if vbusct is not None:
+            self.__vbusct = vbusct
+        if ishct is not None:
+            self.__ishct = ishct
+        if meascont is not None:
+            self.__meascont = meascont
+        if measv is not None:
+            self.__measv = measv
+        if measi is not None:
+            self.__measi = measi
+
     @property
     def avg(self):
         """
@@ -195,11 +277,7 @@ class INA260Controller:
         return self.__avg
     @avg.setter
     def avg(self, avg):
-        assert (avg in AVG), "avg is not in allowed list of values: {}".format(AVG)
-        creg = self._read(REG_CONFIG)
-        creg = self.__setbits(creg, [AVG0, AVG1, AVG2], AVG.index(avg))
-        self._write(REG_CONFIG, creg)
-        self.__avg = avg
+        self.configure(avg=avg)
 
     @property
     def vbusct(self):
@@ -209,11 +287,7 @@ class INA260Controller:
         return self.__vbusct
     @vbusct.setter
     def vbusct(self, vbusct):
-        assert (vbusct in CT), "vbusct is not in allowed list of values: {}".format(CT)
-        creg = self._read(REG_CONFIG)
-        creg = self.__setbits(creg, [VBUSCT0, VBUSCT1, VBUSCT2], CT.index(vbusct))
-        self._write(REG_CONFIG, creg)
-        self.__vbusct = vbusct
+        self.configure(vbusct=vbusct)
 
     @property
     def ishct(self):
@@ -223,11 +297,7 @@ class INA260Controller:
         return self.__ishct
     @ishct.setter
     def ishct(self, ishct):
-        assert (ishct in CT), "ishct is not in allowed list of values: {}".format(CT)
-        creg = self._read(REG_CONFIG)
-        creg = self.__setbits(creg, [ISHCT0, ISHCT1, ISHCT2], CT.index(ishct))
-        self._write(REG_CONFIG, creg)
-        self.__ishct = ishct
+        self.configure(ishct=ishct)
 
     @property
     def meascont(self):
@@ -237,11 +307,7 @@ class INA260Controller:
         return self.__meascont
     @meascont.setter
     def meascont(self, meascont):
-        assert (meascont in [True, False]), "meascont is not boolean"
-        creg = self._read(REG_CONFIG)
-        creg = self.__setbits(creg, [MODE3], meascont)
-        self._write(REG_CONFIG, creg)
-        self.__meascont = meascont
+        self.configure(meascont=meascont)
 
     @property
     def measv(self):
@@ -251,11 +317,7 @@ class INA260Controller:
         return self.__measv
     @measv.setter
     def measv(self, measv):
-        assert (measv in [True, False]), "measv is not boolean"
-        creg = self._read(REG_CONFIG)
-        creg = self.__setbits(creg, [MODE2], measv)
-        self._write(REG_CONFIG, creg)
-        self.__measv = measv
+        self.configure(measv=measv)
 
     @property
     def measi(self):
@@ -265,11 +327,7 @@ class INA260Controller:
         return self.__measi
     @measi.setter
     def measi(self, measi):
-        assert (measi in [True, False]), "measi is not boolean"
-        creg = self._read(REG_CONFIG)
-        creg = self.__setbits(creg, [MODE1], measi)
-        self._write(REG_CONFIG, creg)
-        self.__measi = measi
+        self.configure(measi=measi)
 
     @property
     def alert(self):
@@ -279,10 +337,11 @@ class INA260Controller:
         """
         return self.__alert
     @alert.setter
+    @_buslocked
     def alert(self, alert):
         assert True if alert in [None, ''] else all(i in ALERT for i in alert), \
             "alert contains not only elements from allowed list of values: {}".format(ALERT)
-        mereg = self._read(REG_MASK_ENABLE)
+        mereg = self._cached(REG_MASK_ENABLE)
         alerts = 0
         if alert not in [None, '']:
             alertlist = list(ALERT.index(i) for i in alert)
@@ -309,9 +368,10 @@ class INA260Controller:
         """
         return self.__alertpol
     @alertpol.setter
+    @_buslocked
     def alertpol(self, alertpol):
         assert (alertpol in [0, 1]), "alertpol is not in allowed list of values: {}".format([0, 1])
-        mereg = self._read(REG_MASK_ENABLE)
+        mereg = self._cached(REG_MASK_ENABLE)
         mereg = self.__setbits(mereg, [APOL], alertpol)
         self._write(REG_MASK_ENABLE, mereg)
         self.__alertpol = alertpol
@@ -327,10 +387,11 @@ class INA260Controller:
         """
         return self.__alertlatch
     @alertlatch.setter
+    @_buslocked
     def alertlatch(self, alertlatch):
         assert (alertlatch in [0, 1]), "alertlatch is not in allowed list of values: {}".\
             format([0, 1])
-        mereg = self._read(REG_MASK_ENABLE)
+        mereg = self._cached(REG_MASK_ENABLE)
         if alertlatch == 0:
             mereg = self.__setbits(mereg, [LEN], 0)
             self._write(REG_MASK_ENABLE, mereg)
@@ -373,6 +434,20 @@ class INA260Controller:
             self._write(REG_ALERT, alertint)
             self.__alertlimit = alertlimit
 
+    @property
+    def verify(self):
+        """
+        Property verify enables the verification of each write access to the shadowed
+        configuration and mask/enable registers by reading the register back.
+        Be aware that reading back the mask/enable register clears the conversion ready
+        flag and the latched alert function flag.
+        """
+        return self.__verify
+    @verify.setter
+    def verify(self, verify):
+        assert (verify in [True, False]), "verify is not boolean"
+        self.__verify = verify
+
     @property
     def alertflag(self):
         """
@@ -425,6 +500,19 @@ class INA260Controller:
             GPIO.add_event_callback(self.__alertpin, alertcallback)
         self.__alertcallback = alertcallback
 
+    def __alerttimeout(self, timeout):
+        """
+        Converts the <timeout> parameter of the alert wait methods into milliseconds
+        """
+        if timeout == 'Automatic':
+            timeout = round(2 * self.avg * (self.vbusct * self.measv + \
+                                            self.ishct * self.measi) / 1000)
+            if timeout < 1:
+                timeout = 1
+        elif timeout is not None:
+            timeout = round(timeout * 1000)
+        return timeout
+
     def wait_for_alert_edge(self, timeout=None):
         """
         Blocks execution of your program until an falling edge on the alert pin is detected.
@@ -435,69 +523,177 @@ class INA260Controller:
         """
         assert self.__alertpin is not None, \
             "Alert pin must be specified for callback assignment."
-        if timeout == 'Automatic':
-            timeout = round(2 * self.avg * (self.vbusct * self.measv + \
-                                            self.ishct * self.measi) / 1000)
-            if timeout < 1:
-                timeout = 1
-        elif timeout is not None:
-            timeout = round(timeout * 1000)
+        timeout = self.__alerttimeout(timeout)
         return GPIO.wait_for_edge(self.__alertpin, GPIO.FALLING, timeout=timeout) is not None
 
-    def wait_for_voltage_peak(self, timeout='Automatic', noisethreshold=1.0):
+    @contextlib.contextmanager
+    def __alertedges(self, callback):
+        """
+        Context manager calling <callback> on each falling edge of the alert pin
+        """
+        assert self.__alertpin is not None, \
+            "Alert pin must be specified for callback assignment."
+        assert self.__alertcallback is None, \
+            "Alert pin edges are already handled by alertcallback {}".format(self.__alertcallback)
+        GPIO.add_event_detect(self.__alertpin, GPIO.FALLING, callback=callback)
+        try:
+            yield
+        finally:
+            GPIO.remove_event_detect(self.__alertpin)
+
+    async def wait_for_alert(self, timeout=None):
+        """
+        Coroutine waiting for a falling edge on the alert pin without blocking the
+        event loop. The edge is detected by a RPi.GPIO callback which is handed over
+        to the event loop. <timeout> is treated as for wait_for_alert_edge.
+        Returns False if the timeout has been reached and True otherwise.
+        """
+        loop = asyncio.get_running_loop()
+        edge = loop.create_future()
+        def alertdetected(_):
+            loop.call_soon_threadsafe(lambda: edge.done() or edge.set_result(True))
+        timeout = self.__alerttimeout(timeout)
+        with self.__alertedges(alertdetected):
+            try:
+                await asyncio.wait_for(edge, None if timeout is None else timeout / 1000)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def stream(self, count=None, timeout=None):
+        """
+        Asynchronous generator yielding the tuple (timestamp, voltage, current, power)
+        for each conversion ready edge on the alert pin. The alert pin is set to signal
+        conversion ready, the previous alert functions are restored when the generator
+        is finished or closed. The generator ends after <count> samples (endless if None) or
+        if no conversion has been signaled within <timeout> (treated as for
+        wait_for_alert_edge). If the consumer is slower than the conversions, the
+        intermediate conversions are skipped and the latest one is yielded.
+
+        Usage:
+            async for timestamp, voltage, current, power in ina260.stream():
+                ...
+        """
+        loop = asyncio.get_running_loop()
+        edges = asyncio.Queue(maxsize=1)
+        def put(timestamp):
+            if edges.full():
+                edges.get_nowait()
+            edges.put_nowait(timestamp)
+        def alertdetected(_):
+            loop.call_soon_threadsafe(put, time.time())
+        #The alert functions of the caller are restored when the generator ends
+        alertbuffer = self.alert
+        self.alert = ['Conversion Ready']
+        timeout = self.__alerttimeout(timeout)
+        try:
+            with self.__alertedges(alertdetected):
+                while count is None or count > 0:
+                    try:
+                        timestamp = await asyncio.wait_for(
+                            edges.get(), None if timeout is None else timeout / 1000)
+                    except asyncio.TimeoutError:
+                        return
+                    yield (timestamp,) + self.read_all()
+                    if count is not None:
+                        count -= 1
+        finally:
+            self.alert = None if alertbuffer is None else list(alertbuffer)
+
+    @contextlib.contextmanager
+    def fast_capture(self, avg=1, vbusct=140, ishct=None, meascont=True, measv=True, \
+                     measi=False, alert=('Conversion Ready',)):
+        """
+        Context manager switching the INA260 into a fast capture profile. By default
+        only the bus voltage is measured continously without averaging at the shortest
+        conversion time and the alert pin signals conversion ready.
+        On entry the configuration and mask/enable registers are saved as a whole
+        (from their shadow copies) and the profile is applied with one write into each
+        register. On exit, also if an exception has been raised, both registers are
+        restored with one write each.
+
+        Usage:
+            with ina260.fast_capture():
+                ina260.wait_for_alert_edge(timeout='Automatic')
+                voltage = ina260.voltage()
+        """
+        configword = self._cached(REG_CONFIG)
+        maskword = self._cached(REG_MASK_ENABLE)
+        configbuffer = (self.__avg, self.__vbusct, self.__ishct, self.__meascont, \
+                        self.__measv, self.__measi)
+        alertbuffer = self.__alert
+        try:
+            self.configure(avg=avg, vbusct=vbusct, ishct=ishct, meascont=meascont, \
+                           measv=measv, measi=measi)
+            self.alert = None if alert is None else list(alert)
+            yield self
+        finally:
+            self._write(REG_CONFIG, configword)
+            self._write(REG_MASK_ENABLE, maskword)
+            self.__avg, self.__vbusct, self.__ishct, self.__meascont, \
+                self.__measv, self.__measi = configbuffer
+            self.__alert = alertbuffer
+
+    def wait_for_voltage_peak(self, timeout='Automatic', noisethreshold=1.0, freq=50):
         """
         Routine waits for next voltage peak by checking if successive differences of the last three
         voltage samples change their sign from positive to negative
         Furthermore ensure that the readings are larger than <noisethreshold> to prevent
         trigger through noise
+        The automatic timeout is based on the mains frequency <freq> in Hz, which can be
+        taken from the frequency estimate of SignalAnalysis.MainsTracker.
+        The measurement settings are switched to the fast capture profile and restored
+        afterwards, also if the timeout assertion is raised.
         """
-        #save setup parameters which get overwritten
         if self.__alertpin is not None:
-            alertbuffer = self.alert
-            avgbuffer = self.avg
-            self.avg = 1
-            vbusctbuffer = self.vbusct
-            self.vbusct = 140
-            meascontbuffer = self.meascont
-            self.meascont = True
-            measibuffer = self.measi
-            self.measi = False
-            measvbuffer = self.measv
-            self.measv = True
-            #Automatic timeout stops after 5 periods of 50Hz frequency
+            #Automatic timeout stops after 50 periods of mains frequency
             if timeout == 'Automatic':
                 periods = 50
-                freq = 50
                 timeout = periods / freq
-                errormsg = "Timeout of 5 Periods of mains frequency of 50Hz reached."
+                errormsg = "Timeout of {} Periods of mains frequency of {:.2f}Hz reached.".\
+                    format(periods, freq)
             elif timeout is None:
                 timeout = sys.maxsize
             else:
                 errormsg = "Timeout of {} seconds reached.".format(timeout)
-            #Start measurements by taking three initial samples
-            samples = []
+            #Only the last three samples are needed for the peak detection
+            samples = collections.deque(maxlen=3)
             tstart = time.time()
-            self.alert = ['Conversion Ready']
-            for _ in range(3):
-                self.wait_for_alert_edge(timeout='Automatic')
-                samples.append(self.voltage())
-            #Loop until maximum found or timeout
-            while not (samples[-1]-samples[-2] < 0 < samples[-2]-samples[-3] and\
-                       all(s > noisethreshold for s in samples[-3:])) and \
-                           (time.time() - tstart) < timeout:
-                self.wait_for_alert_edge(timeout='Automatic')
-                samples.append(self.voltage())
-            assert time.time() - tstart < timeout, errormsg
-            #restore saved setup parameters
-            self.alert = alertbuffer
-            self.avg = avgbuffer
-            self.vbusct = vbusctbuffer
-            self.meascont = meascontbuffer
-            self.measi = measibuffer
-            self.measv = measvbuffer
+            with self.fast_capture(), self.fastread(REG_BUS_VOLTAGE):
+                #Start measurements by taking three initial samples
+                for _ in range(3):
+                    self.wait_for_alert_edge(timeout='Automatic')
+                    samples.append(self.voltage())
+                #Loop until maximum found or timeout
+                while not (samples[-1]-samples[-2] < 0 < samples[-2]-samples[-3] and\
+                           all(s > noisethreshold for s in samples)) and \
+                               (time.time() - tstart) < timeout:
+                    self.wait_for_alert_edge(timeout='Automatic')
+                    samples.append(self.voltage())
+                assert time.time() - tstart < timeout, errormsg
             return True
         return False
 
+    def wait_for_settle(self, detector, maxwait=1.0):
+        """
+        Routine waits until the bus voltage has settled according to <detector>
+        (a SignalAnalysis.SettleDetector) or <maxwait> seconds have elapsed.
+        The samples are taken with the fast capture profile, which is restored
+        afterwards. Returns True if the voltage has settled in time and False otherwise.
+        Without alert pin the routine just sleeps for <maxwait> seconds.
+        """
+        if self.__alertpin is None:
+            time.sleep(maxwait)
+            return False
+        detector.reset()
+        tstart = time.time()
+        with self.fast_capture(), self.fastread(REG_BUS_VOLTAGE):
+            while time.time() - tstart < maxwait:
+                if self.wait_for_alert_edge(timeout='Automatic') and \
+                    detector.add(self.voltage(), time.time()):
+                    return True
+        return False
+
     @property
     def conversionready(self):
         """
@@ -557,6 +753,15 @@ class INA260Controller:
         reg |= value << bits[0] # Set specified bits to value <value>
         return reg
 
+    @property
+    def buslock(self):
+        """
+        Reentrant lock held during each register access. Hold it to keep a sequence of
+        accesses from being interleaved with accesses of other threads
+        """
+        return self.__buslock
+
+    @_buslocked
     def _read(self, reg):
         """
         Read a word from the device
@@ -571,9 +776,47 @@ class INA260Controller:
 
         """
 
+        if self.__fastread and self.__fastmsg is not None and reg == self.__pointer:
+            #Register pointer still addresses <reg>, thus a plain read is sufficient
+            self.bus.i2c_rdwr(self.__fastmsg)
+            return struct.unpack('>H', bytes(self.__fastmsg))[0]
+        #The pointer is unknown if the transfer fails
+        self.__pointer = None
         word = struct.unpack('>H', bytes(self.bus.read_i2c_block_data(self.address, reg, 2)))[0]
+        self.__pointer = reg
         return word
 
+    @_buslocked
+    def _read_multiple(self, regs):
+        """
+        Read words from several registers in one combined I2C transaction
+
+        Parameters
+        ---------
+            regs: list of register addresses
+
+        Returns
+        ------
+            list of words in the order of <regs>
+
+        The INA260 does not auto-increment its register pointer, thus for every
+        register a pointer write and a 2-byte read message is queued. All messages
+        are sent with repeated starts in a single i2c_rdwr call, so the bus is not
+        released in between and the registers are read back-to-back. If smbus2 is
+        not available the registers are read one after the other.
+        """
+
+        if i2c_msg is None:
+            return [self._read(reg) for reg in regs]
+        msgs = []
+        for reg in regs:
+            msgs.append(i2c_msg.write(self.address, [reg]))
+            msgs.append(i2c_msg.read(self.address, 2))
+        self.bus.i2c_rdwr(*msgs)
+        self.__pointer = regs[-1]
+        return [struct.unpack('>H', bytes(msg))[0] for msg in msgs[1::2]]
+
+    @_buslocked
     def _write(self, reg, value):
         """
         Writes word <value> into register reg
@@ -594,10 +837,80 @@ class INA260Controller:
         #Convert value to little endian
         value = value & 0xFFFF
         #Exchange high-byte with low-byte
-        value = struct.unpack('<H', struct.pack('>H', value))[0]
+        swapped = struct.unpack('<H', struct.pack('>H', value))[0]
+
+        self.bus.write_word_data(self.address, reg, swapped)
+        self.__pointer = reg
+        #Keep shadow copy of writable registers up to date. Writes setting the reset bit
+        #are skipped since reset() invalidates all shadow copies
+        if reg in SHADOW_MASK and not (reg == REG_CONFIG and value >> RST):
+            self.__shadow[reg] = value & SHADOW_MASK[reg]
+            if self.__verify:
+                readback = self._read(reg) & SHADOW_MASK[reg]
+                assert readback == self.__shadow[reg], \
+                    "Verification of register 0x{:02X} failed. Is 0x{:04X} and should be 0x{:04X}".\
+                        format(reg, readback, self.__shadow[reg])
+
+    @_buslocked
+    def _cached(self, reg):
+        """
+        Returns the shadow copy of the writable register <reg>. If there is no
+        valid shadow copy yet, the register is read from the device.
 
-        self.bus.write_word_data(self.address, reg, value)
+        Parameters
+        ----------
+        reg : Byte
+            Register address. Must be one of the registers in SHADOW_MASK.
 
+        Returns
+        -------
+        Word.
+
+        """
+
+        if reg not in self.__shadow:
+            self.__shadow[reg] = self._read(reg) & SHADOW_MASK[reg]
+        return self.__shadow[reg]
+
+    def invalidate(self):
+        """
+        Invalidates the shadow copies of the configuration and mask/enable registers.
+        The next access reads them again from the device. Has to be called if the
+        registers have been changed by other means than this class.
+        """
+        self.__shadow.clear()
+
+    @contextlib.contextmanager
+    def fastread(self, reg=REG_BUS_VOLTAGE):
+        """
+        Context manager for fast repeated polling of register <reg>.
+        The INA260 keeps its register pointer between reads. Within the context the
+        pointer is set once to <reg> and successive reads of <reg> are done as plain
+        2-byte reads without resending the pointer byte. Accesses to other registers
+        within the context are possible; they move the pointer and the next read of
+        <reg> sets it again. Since the pointer is tracked under the bus lock, reads of
+        other threads (e.g. an INA260Sampler running within this context) can not make
+        a plain read return another register. Requires smbus2, otherwise normal reads
+        are done.
+
+        Usage:
+            with ina260.fastread(INA260.REG_BUS_VOLTAGE):
+                samples.append(ina260.voltage())
+        """
+        assert reg in [REG_CURRENT, REG_BUS_VOLTAGE, REG_POWER], \
+            "Fast read is only supported for the current, bus voltage and power registers"
+        with self.__buslock:
+            if self.__fastmsg is not None:
+                self.bus.i2c_rdwr(i2c_msg.write(self.address, [reg]))
+                self.__pointer = reg
+            self.__fastread += 1
+        try:
+            yield self
+        finally:
+            with self.__buslock:
+                self.__fastread -= 1
+
+    @_buslocked
     def _set_bit(self, reg, bit, value=True):
         """
 
@@ -617,39 +930,83 @@ class INA260Controller:
         None.
 
         """
-        regval = self._read(reg)
+        regval = self._cached(reg) if reg in SHADOW_MASK else self._read(reg)
         if value:
             regval |= 1 << bit
         else:
             regval &= ~(1 << bit)
         self._write(reg, regval)
 
-    def voltage(self):
+    def __raw2voltage(self, voltage):
         """
-        Returns the bus voltage in Volts
-
+        Converts raw bus voltage register content into the measured voltage in Volts
         """
-        voltage = self._read(REG_BUS_VOLTAGE)
         voltage *= V_per_Bit / self.__fvdiv # 1.25mv/bit. Correction for voltage divider
         voltage += self.__vt # Correction for rectifier voltage drop
+        if self.__correction is not None:
+            voltage *= self.__correction # Per-tap correction
 
         return voltage
 
-    def current(self):
+    def __raw2current(self, current): #pylint: disable=R0201
         """
-        Returns the current in Amps
-
+        Converts raw current register content into the current in Amps
         """
-        current = self._read(REG_CURRENT)
-
         # Fix 2's complement
         if current & (1 << 15):
-            current -= 65535
+            current -= 65536
 
         current *= A_per_Bit # 1.25mA/bit
 
         return current
 
+    def __raw2power(self, power):
+        """
+        Converts raw power register content into the power in Watts
+        """
+        power *= W_per_Bit / self.__fvdiv # 10mW/bit. Correction for voltage divider
+
+        return power
+
+    def decode_voltage(self, words):
+        """
+        Converts an array of raw bus voltage register words (e.g. captured with
+        read_raw or INA260Sampler) into the measured voltages in Volts in one
+        vectorized pass. The same corrections as in voltage() are applied.
+        """
+        voltages = np.asarray(words, dtype=np.uint16) * (V_per_Bit / self.__fvdiv) + self.__vt
+        if self.__correction is not None:
+            voltages *= self.__correction
+        return voltages
+
+    def decode_current(self, words): #pylint: disable=R0201
+        """
+        Converts an array of raw current register words into currents in Amps in one
+        vectorized pass. The words are reinterpreted as signed two's complement values.
+        """
+        return np.asarray(words, dtype=np.uint16).view(np.int16) * A_per_Bit
+
+    def decode_power(self, words):
+        """
+        Converts an array of raw power register words into powers in Watts in one
+        vectorized pass. The same corrections as in power() are applied.
+        """
+        return np.asarray(words, dtype=np.uint16) * (W_per_Bit / self.__fvdiv)
+
+    def voltage(self):
+        """
+        Returns the bus voltage in Volts
+
+        """
+        return self.__raw2voltage(self._read(REG_BUS_VOLTAGE))
+
+    def current(self):
+        """
+        Returns the current in Amps
+
+        """
+        return self.__raw2current(self._read(REG_CURRENT))
+
     def power(self):
         """
         Returns the power calculated by the device in Watts
@@ -658,10 +1015,27 @@ class INA260Controller:
         and performing the calculation manually.
         """
 
-        power = self._read(REG_POWER)
-        power *= W_per_Bit / self.__fvdiv # 10mW/bit. Correction for voltage divider
+        return self.__raw2power(self._read(REG_POWER))
 
-        return power
+    def read_raw(self, reg=REG_BUS_VOLTAGE):
+        """
+        Returns the unconverted 16-bit content of the measurement register <reg>.
+        Used for fast acquisition loops which defer the conversion into physical units.
+        """
+        return self._read(reg)
+
+    def read_all(self):
+        """
+        Returns the tuple (voltage, current, power) in Volts, Amps and Watts
+
+        The current, bus voltage and power registers (0x01..0x03) are fetched in one
+        combined I2C transaction instead of three separate ones. Since the bus is
+        held for the whole transaction the three values stem from the same conversion
+        as long as the conversion period (avg * (vbusct + ishct)) is longer than the
+        transaction itself (about 0.4ms at 400kHz bus clock).
+        """
+        current, voltage, power = self._read_multiple([REG_CURRENT, REG_BUS_VOLTAGE, REG_POWER])
+        return self.__raw2voltage(voltage), self.__raw2current(current), self.__raw2power(power)
 
     @property
     def manufacturer_id(self):
@@ -728,6 +1102,20 @@ class INA260Controller:
     def Vt(self, Vt):
         self.__vt = Vt
 
+    @property
+    def correction(self):
+        """
+        Correction factor of the active transformer tap, which multiplies all decoded
+        voltages. None if no correction is applied. The factor of a relay word is given
+        by Calibration.CorrectionTable
+        """
+        return self.__correction
+
+    @correction.setter
+    def correction(self, correction):
+        assert correction is None or correction > 0, "Correction factor must be positive"
+        self.__correction = None if correction is None else float(correction)
+
     def reset(self):
         """
         Generates a system reset that is the same as power-on reset.
@@ -739,6 +1127,8 @@ class INA260Controller:
 
         """
         self._set_bit(REG_CONFIG, RST)
+        #All registers are back at their power-on values, thus the shadow copies are invalid
+        self.invalidate()
 
     def __del__(self):
         self.bus.close()
@@ -0,0 +1,161 @@
+#pylint: disable=C0103,R0902
+"""
+Background acquisition of INA260 measurement registers into a preallocated ring buffer
+"""
+
+import time
+import threading
+import numpy as np #pylint: disable=E0401
+import INA260 #pylint: disable=E0401
+
+class INA260Sampler:
+    """
+    Acquires the raw content of one INA260 measurement register on a dedicated thread.
+    Each sample is triggered by the conversion ready edge on the alert pin and is
+    stored as raw 16-bit word together with its timestamp in a fixed-size ring buffer.
+    Thus the memory stays bounded for arbitrarily long runs and a slow consumer does
+    not delay the acquisition. If the consumer falls behind by more than the buffer
+    size the oldest samples are overwritten and counted as overruns.
+    Each read holds the bus lock of the meter, thus other threads may access the
+    meter while the sampler is running. Their accesses move the register pointer,
+    which costs the next sample one full register read instead of a plain read.
+
+    meter..... INA260Controller object. The alert pin must have been specified
+    size...... Number of samples held in the ring buffer
+    reg....... Register to be sampled. One of INA260.REG_BUS_VOLTAGE,
+               INA260.REG_CURRENT or INA260.REG_POWER
+
+    Usage:
+        with INA260Sampler(ina260, size=1000) as sampler:
+            words, times = sampler.read(300)
+    """
+
+    def __init__(self, meter, size=4096, reg=INA260.REG_BUS_VOLTAGE):
+        assert size > 0, "Size of ring buffer has to be positive"
+        self.__meter = meter
+        self.__reg = reg
+        self.__size = size
+        self.__words = np.zeros(size, dtype=np.uint16)
+        self.__times = np.zeros(size, dtype=np.float64)
+        self.__count = 0 # Total number of acquired samples
+        self.__readpos = 0 # Total index of the next sample returned by read()
+        self.__overruns = 0
+        self.__condition = threading.Condition()
+        self.__running = threading.Event()
+        self.__thread = None
+        self.__alert = None # Alert functions of the meter before start()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, _1, _2, _3):
+        self.stop()
+
+    def start(self):
+        """
+        Configures the alert pin of the INA260 to signal conversion ready and starts
+        the acquisition thread. The previous alert functions are restored by stop()
+        """
+        assert self.__thread is None, "Sampler is already running"
+        self.__alert = self.__meter.alert
+        self.__meter.alert = ['Conversion Ready']
+        self.__running.set()
+        self.__thread = threading.Thread(target=self.__acquire, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops the acquisition thread and restores the alert functions of the meter.
+        The samples in the buffer stay available
+        """
+        if self.__thread is not None:
+            self.__running.clear()
+            self.__thread.join()
+            self.__thread = None
+            self.__meter.alert = None if self.__alert is None else list(self.__alert)
+
+    @property
+    def running(self):
+        """
+        True while the acquisition thread is running
+        """
+        return self.__thread is not None
+
+    @property
+    def count(self):
+        """
+        Total number of samples acquired since creation of the sampler
+        """
+        return self.__count
+
+    @property
+    def overruns(self):
+        """
+        Number of samples which have been overwritten before they were read by read()
+        """
+        return self.__overruns
+
+    def __acquire(self):
+        """
+        Acquisition loop running on the dedicated thread
+        """
+        meter = self.__meter
+        words = self.__words
+        times = self.__times
+        with meter.fastread(self.__reg):
+            while self.__running.is_set():
+                #The timeout ensures that a stop request is recognized
+                if not meter.wait_for_alert_edge(timeout='Automatic'):
+                    continue
+                try:
+                    word = meter.read_raw(self.__reg)
+                except OSError:
+                    print("Error reading bus")
+                    continue
+                timestamp = time.time()
+                with self.__condition:
+                    index = self.__count % self.__size
+                    words[index] = word
+                    times[index] = timestamp
+                    self.__count += 1
+                    self.__condition.notify_all()
+
+    def __slice(self, start, stop):
+        """
+        Returns copies of the raw words and timestamps with the total indices
+        start..stop-1. Has to be called with the condition lock held.
+        """
+        indices = np.arange(start, stop)
+        return np.take(self.__words, indices, mode='wrap'), \
+               np.take(self.__times, indices, mode='wrap')
+
+    def snapshot(self, n=None):
+        """
+        Returns the tuple (words, times) with copies of the latest <n> samples
+        (all buffered samples if <n> is None) in chronological order. Does not
+        change the read position of read()
+        """
+        with self.__condition:
+            available = min(self.__count, self.__size)
+            n = available if n is None else min(n, available)
+            return self.__slice(self.__count - n, self.__count)
+
+    def read(self, n, timeout=None):
+        """
+        Blocks until <n> samples following the samples returned by the previous call
+        are available and returns them as tuple (words, times). If <timeout> in seconds
+        is reached, the samples available so far are returned.
+        """
+        assert 0 < n <= self.__size, "Number of samples has to be in range 1..{}".\
+            format(self.__size)
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__count - self.__readpos >= n, timeout)
+            lost = self.__count - self.__readpos - self.__size
+            if lost > 0:
+                self.__overruns += lost
+                self.__readpos += lost
+            n = min(n, self.__count - self.__readpos)
+            result = self.__slice(self.__readpos, self.__readpos + n)
+            self.__readpos += n
+            return result
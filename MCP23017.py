@@ -32,10 +32,24 @@ class MCP23017:
     respectively.
     The resetpin parameter specifies the BCM port of the Raspberry Pi connected to
     the reset pin of the MCP23017.
+    With attach=True the driver attaches to a running MCP23017 without resetting it
+    and without changing any pin. The shadow copies are loaded from the hardware,
+    thus the relays keep their state when the controlling process is restarted.
+    In this mode the reset pin is not released on deletion of the object.
+    Input pins can be monitored without polling by registering callbacks with
+    add_interrupt() and connecting INTA/INTB to Raspberry Pi pins with enable_interrupts().
+    The IODIR, GPPU and OLAT registers of both ports are held in a shadow copy, thus
+    changing single pins needs just one write access and no read access. Writes into
+    the GPIO registers update the shadow copy of the OLAT registers. The shadow copy
+    can be reloaded from the hardware with resync(). If the attribute verify is set to
+    True each write into a shadowed register is read back and checked.
     """
 
-    def __init__(self, i2cbus=1, device=0x20, bank=0, pinconfig=defaultpinconfig, resetpin=None): #pylint: disable=W0102,R0913
+    def __init__(self, i2cbus=1, device=0x20, bank=0, pinconfig=defaultpinconfig, resetpin=None, \
+                 attach=False): #pylint: disable=W0102,R0913
         self.device = device
+        self.attach = attach
+        self.bank = bank
         self.bus = smbus.SMBus(i2cbus)
         if bank == 0:
             self.gpioa = {reg : 2*i for i, reg in enumerate(mcp23017registers)}
@@ -51,6 +65,21 @@ class MCP23017:
         #Generate a reverse lookup dictionary to look up a pin name specification with
         #the standardized port name and bit number (e.g. C2M -> gpiob4)
         self.gpiopins = {value: key for key, value in pinconfig.items()}
+        #Precompile port index (0: port A, 1: port B) and bit mask of every pin name
+        self.__pinmasks = {value: (["a", "b"].index(key[-2]), 1 << int(key[-1])) \
+                           for key, value in pinconfig.items()}
+        self.__pinnames = dict(pinconfig)
+        #Interrupt callbacks by (port, bit) and Raspi pins connected to INTA/INTB
+        self.__callbacks = {}
+        self.__intpins = []
+        #Shadow copies of the registers which are only changed by this class.
+        #Writes into the GPIO registers are written into the OLAT registers.
+        self.__shadow = {}
+        self.__shadowalias = {self.gpioa["gpio"]: self.gpioa["olat"], \
+                              self.gpiob["gpio"]: self.gpiob["olat"]}
+        self.__shadowregs = [port[reg] for reg in ["iodir", "gppu", "olat"] \
+                             for port in [self.gpioa, self.gpiob]]
+        self.verify = False
         #Define class properties from register list
 #        for reg in mcp23017registers:
 #            setattr(self, reg+"a", self.getregister(reg+"a"))
@@ -62,15 +91,27 @@ class MCP23017:
             GPIO.setmode(GPIO.BCM)
             GPIO.setwarnings(False)
             #Enable MCP23017 by setting reset pin (connected to BCM4) to high
-            GPIO.setup(resetpin, GPIO.OUT)
-            GPIO.output(resetpin, GPIO.HIGH)
-            #Reset MCP23017
-            self.reset()
+            #In attach mode the pin is driven high right away to avoid a reset pulse
+            if attach:
+                GPIO.setup(resetpin, GPIO.OUT, initial=GPIO.HIGH)
+            else:
+                GPIO.setup(resetpin, GPIO.OUT)
+                GPIO.output(resetpin, GPIO.HIGH)
+                #Reset MCP23017
+                self.reset()
+        if bank == 0:
+            #Clear IOCON.SEQOP to enable address pointer increment for block transfers.
+            #This has to happen before the first snapshot of the register file.
+            self.disable_bit(self.gpioa["iocon"], 5)
+        if resetpin is None or attach:
+            self.resync()
         #Set all pins to tri-state by default
-        self.all_to_input()
+        if not attach:
+            self.all_to_input()
 
     def __del__(self):
-        GPIO.cleanup()
+        if not self.attach:
+            GPIO.cleanup()
 
     def reset(self):
         """
@@ -81,6 +122,120 @@ class MCP23017:
             GPIO.output(self.resetpin, GPIO.LOW)
             time.sleep(0.1/1000)
             GPIO.output(self.resetpin, GPIO.HIGH)
+            self.resync()
+
+    def resync(self):
+        """
+        Reloads the shadow copies of the IODIR, GPPU and OLAT registers from the hardware
+        """
+        if self.bank == 0:
+            self.snapshot()
+            return
+        for registeraddr in self.__shadowregs:
+            try:
+                self.__shadow[registeraddr] = self.bus.read_byte_data(self.device, registeraddr)
+            except OSError:
+                print("Error reading bus")
+                self.__shadow.pop(registeraddr, None)
+
+    def snapshot(self):
+        """
+        Reads all 22 registers (BANK=0 address order) in one sequential block transfer
+        and returns them as bytes object. The shadow copies are updated from the result.
+        Returns None if the bus can not be read
+        """
+        assert self.bank == 0, "Snapshot needs BANK=0 register addressing"
+        try:
+            data = bytes(self.bus.read_i2c_block_data(self.device, 0x00, 2*len(mcp23017registers)))
+        except OSError:
+            print("Error reading bus")
+            return None
+        for registeraddr in self.__shadowregs:
+            self.__shadow[registeraddr] = data[registeraddr]
+        return data
+
+    def restore(self, data):
+        """
+        Writes the registers from the bytes object <data> returned by snapshot().
+        The output latches are written first, thus outputs get their level before
+        they are switched to output. Then the registers IODIR to GPPU are written
+        in one sequential block transfer, where the BANK and SEQOP bits of IOCON
+        are kept cleared. INTF, INTCAP and GPIO are read-only or given by OLAT and
+        are not written
+        """
+        assert self.bank == 0, "Restore needs BANK=0 register addressing"
+        assert len(data) == 2*len(mcp23017registers), \
+            "Data must hold {} register values".format(2*len(mcp23017registers))
+        self.__writepair("olat", [data[self.gpioa["olat"]], data[self.gpiob["olat"]]])
+        values = list(data[:self.gpioa["intf"]])
+        for registeraddr in [self.gpioa["iocon"], self.gpiob["iocon"]]:
+            values[registeraddr] &= ~((1 << 7) | (1 << 5)) & 0xFF
+        try:
+            self.bus.write_i2c_block_data(self.device, 0x00, values)
+        except OSError:
+            print("Unable to write bus")
+            return
+        for registeraddr, value in enumerate(values):
+            self.__updateshadow(registeraddr, value)
+
+    def __writebyte(self, registeraddr, value):
+        """
+        Writes <value> into register with address <registeraddr> and updates
+        the shadow copy of the register
+        """
+        try:
+            self.bus.write_byte_data(self.device, registeraddr, value)
+        except OSError:
+            print("Unable to write bus")
+            return
+        self.__updateshadow(registeraddr, value)
+
+    def __writepair(self, register, values):
+        """
+        Writes the values <values> of port A and port B into the registers named <register>.
+        With BANK=0 and IOCON.SEQOP=0 both registers are adjacent and are written in a
+        single block transfer, otherwise in two separate transfers
+        """
+        registeraddrs = [self.gpioa[register], self.gpiob[register]]
+        if self.bank != 0:
+            for registeraddr, value in zip(registeraddrs, values):
+                self.__writebyte(registeraddr, value)
+            return
+        try:
+            self.bus.write_i2c_block_data(self.device, registeraddrs[0], list(values))
+        except OSError:
+            print("Unable to write bus")
+            return
+        for registeraddr, value in zip(registeraddrs, values):
+            self.__updateshadow(registeraddr, value)
+
+    def __updateshadow(self, registeraddr, value):
+        """
+        Updates the shadow copy of the register with address <registeraddr> after
+        <value> has been written into it and verifies it if requested
+        """
+        registeraddr = self.__shadowalias.get(registeraddr, registeraddr)
+        if registeraddr in self.__shadowregs:
+            self.__shadow[registeraddr] = value
+            if self.verify:
+                readback = self.bus.read_byte_data(self.device, registeraddr)
+                assert readback == value, \
+                    "Verification of register {} failed. Is 0x{:02X} and should be 0x{:02X}".\
+                        format(self.gpioregs[registeraddr], readback, value)
+
+    def __readbyte(self, registeraddr):
+        """
+        Returns the shadow copy of register with address <registeraddr> if it exists and
+        reads it from the hardware otherwise. Returns None if the bus can not be read
+        """
+        registeraddr = self.__shadowalias.get(registeraddr, registeraddr)
+        if registeraddr in self.__shadow:
+            return self.__shadow[registeraddr]
+        try:
+            return self.bus.read_byte_data(self.device, registeraddr)
+        except OSError:
+            print("Error reading bus")
+            return None
 
     def registeraddr(self, register="iodira"):
         """
@@ -137,10 +292,24 @@ class MCP23017:
             register = self.gpioregs[registeraddr]
         else:
             raise TypeError("Register must be string(register name) or integer(register address)")
-        try:
-            self.bus.write_byte_data(self.device, registeraddr, value)
-        except OSError:
-            print("Unable to write bus")
+        self.__writebyte(registeraddr, value)
+
+    def write_ports(self, word):
+        """
+        Writes the 16-bit word <word> into the output latches of both ports.
+        The MSB byte is port A the LSB byte is port B. With BANK=0 both ports
+        are switched in a single bus transfer
+        """
+        assert (0 <= word <= 0xFFFF), \
+            "Word holds a 16-bit value. Needs to be in range 0x0000..0xFFFF"
+        self.__writepair("olat", [word >> 8, word & 0xFF])
+
+    @property
+    def ports(self):
+        """
+        16-bit word of the output latches of both ports (MSB byte is port A)
+        """
+        return self.__readbyte(self.gpioa["olat"]) << 8 | self.__readbyte(self.gpiob["olat"])
 
     def all_to_input(self, pullup=False):
         """
@@ -160,39 +329,31 @@ class MCP23017:
         self.setregister("iodira", value=0x00)
         self.setregister("gpioa", value=0xFF if state else 0x00)
         self.setregister("iodirb", value=0x00)
-        self.setregister("gpioa", value=0xFF if state else 0x00)
+        self.setregister("gpiob", value=0xFF if state else 0x00)
 
     def enable_bit(self, registeraddr, bit=0):
         """
         Enables bit <bit> in register with address <registeraddr>
         """
         assert (bit in range(8)), "Bit must be in the range 0..7"
-        try:
-            value_old = self.bus.read_byte_data(self.device, registeraddr)
-            newvalue = value_old | (1<<bit)
-        except OSError:
-            print("Unable to read bus")
+        value_old = self.__readbyte(registeraddr)
+        if value_old is None:
+            return
+        newvalue = value_old | (1<<bit)
         if newvalue != value_old:
-            try:
-                self.bus.write_byte_data(self.device, registeraddr, newvalue)
-            except OSError:
-                print("Unable to write bus")
+            self.__writebyte(registeraddr, newvalue)
 
     def disable_bit(self, registeraddr, bit=0):
         """
         Disables bit <bit> in register with address <registeraddr>
         """
         assert (bit in range(8)), "Bit must be in the range 0..7"
-        try:
-            value_old = self.bus.read_byte_data(self.device, registeraddr)
-            newvalue = value_old & ~(1<<bit)
-        except OSError:
-            print("Unable to read bus")
+        value_old = self.__readbyte(registeraddr)
+        if value_old is None:
+            return
+        newvalue = value_old & ~(1<<bit)
         if newvalue != value_old:
-            try:
-                self.bus.write_byte_data(self.device, registeraddr, newvalue)
-            except OSError:
-                print("Unable to read bus")
+            self.__writebyte(registeraddr, newvalue)
 
     def name2portbit(self, pin):
         """
@@ -228,6 +389,53 @@ class MCP23017:
         self.disable_bit(self.registeraddr("iodir"+port), bit)
         self.disable_bit(self.registeraddr("gpio"+port), bit)
 
+    def set_pins(self, pins):
+        """
+        Sets several pins to output with the states given in the dictionary <pins>
+        of pin names and states, e.g. {"Mains": 1, "C2M": 0}. All changes are merged
+        into at most one write of the OLAT registers followed by one write of the
+        IODIR registers, thus the pins get their new state before they are
+        switched to output
+        """
+        self.prepare_pins(pins)()
+
+    def prepare_pins(self, pins):
+        """
+        Prepares the writes of set_pins(<pins>) and returns a function without
+        arguments issuing them. The register values are computed from the shadow copies
+        at the time of preparation, thus the function just transfers them over the bus.
+        If the pins of only one port change, only this register is written. Other pins
+        must not be changed between preparation and call of the function
+        """
+        outputs = [0x00, 0x00]
+        states = [0x00, 0x00]
+        for pin, state in pins.items():
+            assert (pin in self.__pinmasks), "Unknown pin name {}".format(pin)
+            index, mask = self.__pinmasks[pin]
+            outputs[index] |= mask
+            if state:
+                states[index] |= mask
+        writes = []
+        for register in ["olat", "iodir"]:
+            old = [self.__readbyte(self.gpioa[register]), self.__readbyte(self.gpiob[register])]
+            if None in old:
+                continue
+            if register == "olat":
+                new = [(value & ~outputs[i]) | states[i] for i, value in enumerate(old)]
+            else:
+                new = [value & ~outputs[i] for i, value in enumerate(old)]
+            changed = [i for i in range(2) if new[i] != old[i]]
+            if len(changed) == 2:
+                writes.append((self.__writepair, (register, new)))
+            elif len(changed) == 1:
+                port = [self.gpioa, self.gpiob][changed[0]]
+                writes.append((self.__writebyte, (port[register], new[changed[0]])))
+
+        def commit():
+            for write, args in writes:
+                write(*args)
+        return commit
+
     def setinput(self, pin=None, port="a", bit=0):
         """
         Set bit <bit> of gpio port <port> to input
@@ -267,3 +475,115 @@ class MCP23017:
         if returnvalue == 0:
             return 0
         return 1
+
+    def add_interrupt(self, pin=None, port="a", bit=0, callback=None, \
+                      compare=None): #pylint: disable=R0913
+        """
+        Sets bit <bit> of gpio port <port> to input and enables its interrupt.
+        If <compare> is None the interrupt is triggered on every change of the pin,
+        otherwise when the pin differs from <compare> (0 or 1). <callback> is called
+        with the pin name and the captured pin value. If <pin> is specified (not None)
+        the <port> and <bit> settings are derived from the gpiopins dictionary
+        """
+        assert callback is not None, "Callback routine has to be specified"
+        assert compare in [None, 0, 1], "Compare value must be None, 0 or 1"
+        if pin is not None:
+            port, bit = self.name2portbit(pin)
+        self.enable_bit(self.registeraddr("iodir"+port), bit)
+        if compare is None:
+            self.disable_bit(self.registeraddr("intcon"+port), bit)
+        else:
+            if compare:
+                self.enable_bit(self.registeraddr("defval"+port), bit)
+            else:
+                self.disable_bit(self.registeraddr("defval"+port), bit)
+            self.enable_bit(self.registeraddr("intcon"+port), bit)
+        self.__callbacks[(port, bit)] = callback
+        self.enable_bit(self.registeraddr("gpinten"+port), bit)
+
+    def remove_interrupt(self, pin=None, port="a", bit=0):
+        """
+        Disables the interrupt of bit <bit> of gpio port <port> and removes its callback
+        If <pin> is specified (not None) the <port> and <bit> settings are
+        derived from the gpiopins dictionary
+        """
+        if pin is not None:
+            port, bit = self.name2portbit(pin)
+        self.disable_bit(self.registeraddr("gpinten"+port), bit)
+        self.__callbacks.pop((port, bit), None)
+
+    def enable_interrupts(self, intpin_a, intpin_b=None):
+        """
+        Connects the interrupt outputs of the MCP23017 to the Raspi pins <intpin_a>
+        (INTA) and <intpin_b> (INTB). If <intpin_b> is None, IOCON.MIRROR is set and
+        INTA signals the interrupts of both ports. The interrupt outputs are active-low,
+        on each falling edge the flags and captured values of both ports are read and
+        the callbacks of the flagged pins are called
+        """
+        self.disable_interrupts()
+        iocon = self.gpioa["iocon"]
+        if intpin_b is None:
+            self.enable_bit(iocon, 6)
+        else:
+            self.disable_bit(iocon, 6)
+        #Active driver output with active-low polarity
+        self.disable_bit(iocon, 2)
+        self.disable_bit(iocon, 1)
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        self.__intpins = [intpin for intpin in [intpin_a, intpin_b] if intpin is not None]
+        for intpin in self.__intpins:
+            GPIO.setup(intpin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+            GPIO.add_event_detect(intpin, GPIO.FALLING, callback=self.__interrupt)
+        #Clear pending interrupts, otherwise INTA/INTB stay low and no edge occurs
+        self.__readinterrupts()
+
+    def disable_interrupts(self):
+        """
+        Disconnects the Raspi pins from the interrupt outputs of the MCP23017.
+        The interrupt configuration of the pins is kept
+        """
+        for intpin in self.__intpins:
+            GPIO.remove_event_detect(intpin)
+        self.__intpins = []
+
+    def __readinterrupts(self):
+        """
+        Reads the INTF and INTCAP registers of both ports (in one block transfer with
+        BANK=0) and returns the lists of flags and captured values of port A and B.
+        Reading INTCAP clears the interrupt
+        """
+        try:
+            if self.bank == 0:
+                intf0, intf1, intcap0, intcap1 = \
+                    self.bus.read_i2c_block_data(self.device, self.gpioa["intf"], 4)
+            else:
+                intf0, intf1, intcap0, intcap1 = [self.bus.read_byte_data(self.device, port[reg]) \
+                    for reg in ["intf", "intcap"] for port in [self.gpioa, self.gpiob]]
+        except OSError:
+            print("Error reading bus")
+            return [0, 0], [0, 0]
+        return [intf0, intf1], [intcap0, intcap1]
+
+    def dispatch_interrupts(self):
+        """
+        Reads and clears the pending interrupts and calls the callbacks of the flagged
+        pins. Called on each falling edge of INTA/INTB after enable_interrupts(), can
+        also be called directly to poll the interrupts without the Raspi pins connected.
+        Returns the list of pin names that were dispatched
+        """
+        flags, captures = self.__readinterrupts()
+        dispatched = []
+        for index, port in enumerate(["a", "b"]):
+            for bit in range(8):
+                if flags[index] & (1 << bit) and (port, bit) in self.__callbacks:
+                    name = self.__pinnames.get("gpio"+port+str(bit), "gpio"+port+str(bit))
+                    self.__callbacks[(port, bit)](name, (captures[index] >> bit) & 1)
+                    dispatched.append(name)
+        return dispatched
+
+    def __interrupt(self, channel): #pylint: disable=W0613
+        """
+        Callback of the Raspi pins connected to INTA/INTB
+        """
+        self.dispatch_interrupts()
@@ -0,0 +1,115 @@
+#pylint: disable=C0103,R0902,R0913
+# -*- coding: utf-8 -*-
+"""
+Switching of the transformer mains relay synchronized to the mains voltage waveform
+"""
+
+import time
+import collections
+from INA260 import REG_BUS_VOLTAGE #pylint: disable=E0401
+from SignalAnalysis import MainsTracker
+
+#Typical operate and release time of the mains relay in seconds
+MAINS_RELAY_LATENCY = 0.010
+#Initial estimate of the duration of the I2C transfer writing the relay state in seconds
+I2C_TRANSFER_TIME = 0.0003
+
+#Result of a synchronized switching operation. <target> and <written> are the
+#time.perf_counter() values of the predicted waveform instant and of the completion
+#of the relay write, <phase> is the estimated phase in degrees at which the write plus
+#the latency took effect and <error> its deviation from the requested phase
+#(-180..180 degrees).
+#Without a locked phase estimate the relay is switched immediately and <target>,
+#<phase> and <error> are None
+SwitchResult = collections.namedtuple('SwitchResult', ['target', 'written', 'phase', 'error'])
+
+class MainsSwitch:
+    """
+    Switches the mains pin of the MCP23017 port expander at a predicted instant of the
+    mains voltage waveform (e.g. peak or zero crossing). The phase of the mains
+    voltage is tracked with a MainsTracker fed by the fast capture profile of the
+    INA260 power meter. The write of the relay state is prepared before the capture,
+    and the capture profile is restored before the write is scheduled, thus at the
+    switching instant just one I2C transfer is issued. The transfer is started its
+    expected duration before the write has to take effect; the duration is measured
+    at each switching.
+    Since the voltage is measured behind the mains relay, switching on relies on the
+    phase estimate of the last tracking while mains was on.
+
+    meter........ INA260Controller object with alert pin
+    portextender. MCP23017 object
+    pin.......... Name of the mains pin
+    latency...... Delay in seconds between the write and the switching of the relay,
+                  the write is completed this time before the predicted instant
+    tracker...... MainsTracker object, a new one is created if None
+    transfer..... Expected duration of the I2C transfer of the write in seconds,
+                  replaced by the measured duration after each switching
+    """
+
+    def __init__(self, meter, portextender, pin="Mains", latency=MAINS_RELAY_LATENCY, \
+                 tracker=None, transfer=I2C_TRANSFER_TIME):
+        self.meter = meter
+        self.portextender = portextender
+        self.pin = pin
+        self.latency = latency
+        self.tracker = MainsTracker() if tracker is None else tracker
+        self.transfer = transfer
+
+    def track(self, duration=0.2):
+        """
+        Samples the bus voltage for <duration> seconds with the fast capture profile
+        and feeds the samples into the tracker. Returns True if the tracker is locked
+        """
+        tstart = time.perf_counter()
+        with self.meter.fast_capture(), self.meter.fastread(REG_BUS_VOLTAGE):
+            while time.perf_counter() - tstart < duration:
+                if self.meter.wait_for_alert_edge(timeout='Automatic'):
+                    #The sample has been converted at the alert edge, thus it is
+                    #timestamped before the read instead of after it
+                    timestamp = time.perf_counter()
+                    self.tracker.add(self.meter.voltage(), timestamp)
+        return self.tracker.locked
+
+    def switch(self, state, phase=90.0, duration=0.2, margin=0.002):
+        """
+        Switches the mains pin to <state> at the next instant of <phase> degrees of the
+        mains voltage (90 peak, 0 rising and 180 falling zero crossing) and returns a
+        SwitchResult tuple. The phase is tracked for <duration> seconds before if mains
+        is on. <margin> is the minimum time in seconds between the end of the tracking
+        and the write, which covers the scheduling of the write
+        """
+        commit = self.portextender.prepare_pins({self.pin: state})
+        if self.portextender.value(self.pin):
+            self.track(duration)
+        if not self.tracker.locked:
+            commit()
+            return SwitchResult(None, time.perf_counter(), None, None)
+        target = self.tracker.next_instant(phase, time.perf_counter() + self.latency + \
+                                           self.transfer + margin)
+        start = target - self.latency - self.transfer
+        #Sleep coarsely and spin for the last millisecond
+        remaining = start - time.perf_counter()
+        if remaining > 0.001:
+            time.sleep(remaining - 0.001)
+        while time.perf_counter() < start:
+            pass
+        started = time.perf_counter()
+        commit()
+        #The relay state is latched at the end of the transfer
+        written = time.perf_counter()
+        self.transfer = written - started
+        achieved = self.tracker.phase(written + self.latency)
+        error = (achieved - phase + 180.0) % 360.0 - 180.0
+        return SwitchResult(target, written, achieved, error)
+
+    def on(self, phase=0.0):
+        """
+        Switches mains on at the next instant of <phase> (default rising zero crossing)
+        """
+        return self.switch(True, phase)
+
+    def off(self, phase=90.0):
+        """
+        Switches mains off at the next instant of <phase> (default voltage peak)
+        """
+        return self.switch(False, phase)
@@ -6,6 +6,7 @@ OLED Display Driver Class Module
 """
 import time
 
+import numpy as np #pylint: disable=E0401
 import RPi.GPIO as GPIO #pylint: disable=E0401
 
 import spidev #pylint: disable=E0401
@@ -65,9 +66,30 @@ YELLOW  = 0xFFE0
 WHITE   = 0xFFFF
 #pylint: enable=C0326
 
+#Maximum size of a single transfer of the spidev kernel driver
+SPIDEV_BUFSIZ_FILE = "/sys/module/spidev/parameters/bufsiz"
+SPIDEV_BUFSIZ = 4096
+
+def rgb888_to_rgb565(Image):
+    """
+    Converts the PIL image <Image> (or an array of shape (height, width, 3) with
+    8 bit color components) into an array of RGB565 pixels of shape (height, width).
+    The array has big endian byte order, thus its tobytes() is the byte sequence
+    written into the display RAM
+    """
+    if hasattr(Image, "convert"):
+        Image = Image.convert("RGB")
+    rgb = np.asarray(Image, dtype=np.uint16)
+    return (((rgb[:, :, 0] & 0xF8) << 8) | ((rgb[:, :, 1] & 0xFC) << 3) | \
+            (rgb[:, :, 2] >> 3)).astype('>u2')
+
 class OLEDDriver:
     """
     Driver Class for 1.5\" OLED Display with SSD1351 MCU Controller
+    Besides the direct drawing methods the driver holds an RGB565 framebuffer.
+    Update_Image() draws into the framebuffer and flush() transfers only the
+    rectangles which differ from the content shown on the display. The direct
+    drawing methods write to the display and into the framebuffer.
     """
 
     def __init__(self, SPIBus=0, SPIDev=0, RSTPin=25, DCPin=24, CSPin=8):
@@ -81,7 +103,11 @@ class OLEDDriver:
         self.CS_PIN = CSPin #CS: Chip Select Pin. Low to enable device, high to disable
         #buffers
         self.__color_byte = [0x00, 0x00]
-        self.__color_fill_byte = [0x00, 0x00]*(SSD1351_WIDTH)
+        #RGB565 framebuffer and copy of the display content in big endian byte order
+        self.__framebuffer = np.zeros((SSD1351_HEIGHT, SSD1351_WIDTH), dtype='>u2')
+        self.__displayed = np.zeros((SSD1351_HEIGHT, SSD1351_WIDTH), dtype='>u2')
+        #RAM address of the last Set_Address() used by Write_text()
+        self.__address = (0, 0)
         #GPIO init
         GPIO.setwarnings(False)
         GPIO.setup(self.RST_PIN, GPIO.OUT)
@@ -91,6 +117,12 @@ class OLEDDriver:
         self.SPI = spidev.SpiDev(SPIBus, SPIDev)
         self.SPI.max_speed_hz = 9000000 # 9MHz SPI Clock Frequency
         self.SPI.mode = 0b00 #SPI Mode 0: Clock idle at low, Clock Phase at first edge
+        #Bulk transfers are split into chunks of the spidev buffer size
+        try:
+            with open(SPIDEV_BUFSIZ_FILE, 'r') as f:
+                self.bufsiz = int(f.read())
+        except (OSError, ValueError):
+            self.bufsiz = SPIDEV_BUFSIZ
         #Initialize commands of SSD1351 Controller
         #CS to low enables device
         self.OLED_CS(0)
@@ -278,6 +310,18 @@ class OLEDDriver:
         self.SPI_WriteByte(data)
         self.OLED_CS(1)
 
+    def Write_Bulk(self, data):
+        """
+        Write the bytes object <data> to OLED display as data. CS and DC are set once
+        and the bytes are transferred in chunks of the spidev buffer size
+        """
+        data = memoryview(data)
+        self.OLED_CS(0)
+        self.OLED_DC(1)
+        for start in range(0, len(data), self.bufsiz):
+            self.SPI.writebytes2(data[start:start + self.bufsiz])
+        self.OLED_CS(1)
+
     def RAM_Address(self):
         """
         Reset row and column start and end addresses to the maximum range [0,127]
@@ -298,13 +342,8 @@ class OLEDDriver:
         self.RAM_Address() # Reset row and column address ranges
         self.Write_Command(SSD1351_CMD_WRITERAM) # Enable MCU to write Data into RAM
         self.Set_Color(color) # Write into global color_byte buffer variable
-        # shift color_byte buffer by 7 bits and write into color_fill_Byte
-        self.__color_fill_byte = self.__color_byte*SSD1351_WIDTH
-        self.OLED_CS(0)
-        self.OLED_DC(1)
-        for _ in range(0, SSD1351_HEIGHT):
-            self.SPI_WriteByte(self.__color_fill_byte)
-        self.OLED_CS(1)
+        self.Write_Bulk(bytes(self.__color_byte)*(SSD1351_WIDTH*SSD1351_HEIGHT))
+        self.__drawn(slice(None), slice(None), color)
 
     def Clear_Screen(self):
         """
@@ -313,12 +352,16 @@ class OLEDDriver:
 
         self.RAM_Address()
         self.Write_Command(SSD1351_CMD_WRITERAM)
-        self.__color_fill_byte = [0x00, 0x00] *SSD1351_WIDTH
-        self.OLED_CS(0)
-        self.OLED_DC(1)
-        for _ in range(0, SSD1351_HEIGHT):
-            self.SPI_WriteByte(self.__color_fill_byte)
-        self.OLED_CS(1)
+        self.Write_Bulk(bytes(2*SSD1351_WIDTH*SSD1351_HEIGHT))
+        self.__drawn(slice(None), slice(None), BLACK)
+
+    def __drawn(self, rows, columns, colors):
+        """
+        Mirrors pixels written directly to the display RAM into the framebuffer and
+        the copy of the display content, thus flush() neither misses nor overwrites them
+        """
+        self.__framebuffer[rows, columns] = colors
+        self.__displayed[rows, columns] = colors
 
     def Draw_Pixel(self, x, y):
         """
@@ -332,6 +375,7 @@ class OLEDDriver:
         self.Set_Address(x, y)
         # transfer data
         self.Write_Datas(self.__color_byte)
+        self.__drawn(y, x, (self.__color_byte[0] << 8) | self.__color_byte[1])
 
     def Set_Coordinate(self, x, y):
         """
@@ -352,6 +396,7 @@ class OLEDDriver:
         """
         Set RAM column to column and start row to row and stop row to row+7
         """
+        self.__address = (column, row)
         self.Write_Command(SSD1351_CMD_SETCOLUMN)
         self.Write_Data(column)  #X start
         self.Write_Data(column)  #X end
@@ -364,11 +409,15 @@ class OLEDDriver:
         """
         Write text <dat> on display
         """
-        for _ in range(0, 8):
+        column, row = self.__address
+        color = (self.__color_byte[0] << 8) | self.__color_byte[1]
+        for i in range(0, 8):
             if dat & 0x01:
                 self.Write_Datas(self.__color_byte)
             else:
                 self.Write_Datas([0x00, 0x00])
+            if row + i < SSD1351_HEIGHT:
+                self.__drawn(row + i, column, color if dat & 0x01 else BLACK)
             dat = dat >> 1
 
     def Invert(self, v):
@@ -401,6 +450,7 @@ class OLEDDriver:
 
         for _ in range(0, length):
             self.Write_Datas(self.__color_byte)
+        self.__drawn(y, slice(x, x+length), (self.__color_byte[0] << 8) | self.__color_byte[1])
 
     def Draw_FastVLine(self, x, y, length):
         """
@@ -426,6 +476,7 @@ class OLEDDriver:
 
         for _ in range(0, length):
             self.Write_Datas(self.__color_byte)
+        self.__drawn(slice(y, y+length), x, (self.__color_byte[0] << 8) | self.__color_byte[1])
 
     def Display_Image(self, Image):
         """
@@ -434,15 +485,79 @@ class OLEDDriver:
         if Image is None:
             return
 
+        self.Update_Image(Image)
         self.Set_Coordinate(0, 0)
-        buffer1 = Image.load()
-        for j in range(0, SSD1351_WIDTH):
-            for i in range(0, SSD1351_HEIGHT):
-                self.__color_fill_byte[i*2] = ((buffer1[i, j][0] & 0xF8)|\
-                                               (buffer1[i, j][1] >> 5))
-                self.__color_fill_byte[i*2+1] = (((buffer1[i, j][1] << 3) & 0xE0)|\
-                                                  (buffer1[i, j][2] >> 3))
-            self.Write_Datas(self.__color_fill_byte)
+        self.Write_Bulk(self.__framebuffer.tobytes())
+        self.__displayed[:, :] = self.__framebuffer
+
+    @property
+    def framebuffer(self):
+        """
+        RGB565 framebuffer as numpy array of shape (height, width). Changes are
+        transferred to the display by flush()
+        """
+        return self.__framebuffer
+
+    def Update_Image(self, Image):
+        """
+        Draws the image given in PIL object <Image> into the framebuffer without
+        transferring it to the display
+        """
+        if Image is None:
+            return
+        pixels = rgb888_to_rgb565(Image)[:SSD1351_HEIGHT, :SSD1351_WIDTH]
+        self.__framebuffer[:pixels.shape[0], :pixels.shape[1]] = pixels
+
+    def dirty_rectangles(self):
+        """
+        Returns the list of rectangles (x0, y0, x1, y1) with inclusive end coordinates
+        in which the framebuffer differs from the display. Consecutive changed rows are
+        combined into one rectangle spanning the changed columns of these rows
+        """
+        changed = self.__framebuffer != self.__displayed
+        rows = np.flatnonzero(changed.any(axis=1))
+        if rows.size == 0:
+            return []
+        #Split the changed rows into bands of consecutive rows
+        bands = np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1)
+        rectangles = []
+        for band in bands:
+            columns = np.flatnonzero(changed[band[0]:band[-1]+1].any(axis=0))
+            rectangles.append((int(columns[0]), int(band[0]), int(columns[-1]), int(band[-1])))
+        return rectangles
+
+    def Set_Window(self, x0, y0, x1, y1):
+        """
+        Sets the RAM window to columns <x0>..<x1> and rows <y0>..<y1> and enables
+        writing into the RAM
+        """
+        self.Write_Command(SSD1351_CMD_SETCOLUMN)
+        self.Write_Data(x0)
+        self.Write_Data(x1)
+        self.Write_Command(SSD1351_CMD_SETROW)
+        self.Write_Data(y0)
+        self.Write_Data(y1)
+        self.Write_Command(SSD1351_CMD_WRITERAM)
+
+    def flush(self):
+        """
+        Transfers the changed rectangles of the framebuffer to the display and
+        returns the list of transferred rectangles
+        """
+        rectangles = self.dirty_rectangles()
+        for x0, y0, x1, y1 in rectangles:
+            self.Set_Window(x0, y0, x1, y1)
+            region = self.__framebuffer[y0:y1+1, x0:x1+1]
+            self.Write_Bulk(region.tobytes())
+            self.__displayed[y0:y1+1, x0:x1+1] = region
+        return rectangles
+
+    def invalidate(self):
+        """
+        Marks the whole display as changed, thus the next flush() transfers the
+        complete framebuffer
+        """
+        self.__displayed[:, :] = ~self.__framebuffer
 
     def __del__(self):
         self.Clear_Screen()
@@ -12,9 +12,9 @@ Created on Sat Aug 29 22:12:34 2020
 import time
 import os
 from math import sqrt, log10, floor
-from statistics import mean, stdev
 import numpy as np
 import INA260 #pylint: disable=E0401
+from SignalAnalysis import PeriodEstimator
 from MCP23017 import MCP23017
 
 #create chip driver with bank=0 mode on address 0x20
@@ -57,35 +57,29 @@ if os.path.exists(filename):
 #Use fastest setting to measure voltage (no averaging, shortest conversion time and no current
 #measurement)
 
-ina260.avg = 1
-ina260.measi = False
-ina260.vbusct = 140
+ina260.configure(avg=1, vbusct=140, measi=False)
 ina260.alert = ['Conversion Ready']
 
 count = n = 300
-samples = []
-
-#Sample <count> measurements
-while count > 0:
-    ina260.wait_for_alert_edge(timeout='Automatic')
-    samples.append(ina260.voltage())
-
-    count -= 1
-
-effective = []
-startindex = 0
-for i in range(len(samples)-1):
-    pair = samples[i:i+2]
-    if pair[0] < 0.1 < pair[1]:
-        #Calculate average of period between startindex from
-        #previous period and identified new startindex
-        average = np.trapz(samples[startindex:i]) / (i-startindex+1)
-        effective.append(average * sqrt(2))
-        startindex = i
-        print("Effective value: {:5.3f}V".format(effective[-1]))
-
-#Calculate mean value over all measured periods but drop the
-#incomplete first and last period
+words = np.zeros(n, dtype=np.uint16)
+
+#Sample <count> raw measurements. The register pointer is set only once to the
+#bus voltage register and the conversion into Volts is done after the capture
+with ina260.fastread(INA260.REG_BUS_VOLTAGE):
+    for index in range(count):
+        ina260.wait_for_alert_edge(timeout='Automatic')
+        words[index] = ina260.read_raw(INA260.REG_BUS_VOLTAGE)
+
+samples = ina260.decode_voltage(words).tolist()
+
+#Evaluate the effective value of each period. The incomplete periods before the
+#first and after the last rising crossing are dropped by the estimator
+estimator = PeriodEstimator(threshold=0.1, scale=sqrt(2), \
+                            callback=lambda period: print("Effective value: {:5.3f}V".\
+                                                          format(period.mean)))
+estimator.extend(samples)
+
+#Calculate mean value over all measured periods
 def round_to_1(x, ref=None):
     """
     rounds x to most significant digit
@@ -95,8 +89,15 @@ def round_to_1(x, ref=None):
         ref = x
     return round(x, -int(floor(log10(abs(ref)))))
 
-error = sqrt((stdev(effective[1:-1]) ** 2)/n)
-print("Mean effective value {}\u00B1{}V".format(round_to_1(mean(effective[1:-1]), ref=error), round_to_1(error)))
+error = estimator.stderr
+#The standard error needs at least two complete periods
+if error:
+    print("Mean effective value {}\u00B1{}V".format(round_to_1(estimator.mean, ref=error), \
+                                                   round_to_1(error)))
+elif estimator.mean is not None:
+    print("Mean effective value {:5.3f}V\u00B1n/a".format(estimator.mean))
+else:
+    print("Mean effective value n/a (no complete period captured)")
 
 logfile = open(filename, 'w')
 logfile.writelines(map(lambda x: str(x)+'\n', samples))
@@ -0,0 +1,153 @@
+#pylint: disable=C0103
+# -*- coding: utf-8 -*-
+"""
+Reference meters delivering the external AC voltage readings for the calibration
+of the INA260 power meter. All meters provide read() for a single reading and
+read_many() for several readings. open_meter() creates a meter from a specification
+string, e.g. given on the command line.
+"""
+
+import abc
+import socket
+import random
+
+class ReferenceMeter(abc.ABC):
+    """
+    Base class of the reference meters. Derived classes have to implement read().
+    Meters which need an operator at the console are marked as interactive, they
+    have to be read on the main thread
+    """
+    interactive = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @abc.abstractmethod
+    def read(self):
+        """
+        Returns one reading of the AC voltage in Volts
+        """
+
+    def read_many(self, count=1):
+        """
+        Returns a list of <count> readings of the AC voltage in Volts
+        """
+        return [self.read() for _ in range(count)]
+
+    def close(self):
+        """
+        Releases the connection to the meter
+        """
+
+class ManualMeter(ReferenceMeter):
+    """
+    Reference meter read by an operator who enters the readings at the console
+    """
+    interactive = True
+
+    def __init__(self, prompt="Please enter external voltage reading:"):
+        self.prompt = prompt
+
+    def read(self):
+        """
+        Asks the operator for a reading until a valid number has been entered
+        """
+        while True:
+            try:
+                return float(input(self.prompt))
+            except ValueError:
+                print("Reading must be a number")
+
+class SCPIMeter(ReferenceMeter):
+    """
+    Reference meter (e.g. bench multimeter) controlled by SCPI commands over a raw
+    TCP socket. The connection is opened on the first reading.
+
+    host..... Hostname or IP address of the meter
+    port..... TCP port of the SCPI socket service (5025 for most instruments)
+    command.. Query returning one AC voltage reading
+    timeout.. Socket timeout in seconds
+    """
+
+    def __init__(self, host, port=5025, command="MEAS:VOLT:AC?", timeout=5.0):
+        self.host = host
+        self.port = port
+        self.command = command
+        self.timeout = timeout
+        self.__socket = None
+        self.__buffer = b""
+
+    def query(self, command):
+        """
+        Sends <command> to the meter and returns the response line as string
+        """
+        if self.__socket is None:
+            self.__socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self.__buffer = b""
+        self.__socket.sendall(command.encode("ascii") + b"\n")
+        while b"\n" not in self.__buffer:
+            data = self.__socket.recv(4096)
+            if not data:
+                self.close()
+                raise ConnectionError("Connection closed by {}:{}".format(self.host, self.port))
+            self.__buffer += data
+        line, self.__buffer = self.__buffer.split(b"\n", 1)
+        return line.decode("ascii").strip()
+
+    def read(self):
+        """
+        Queries one AC voltage reading
+        """
+        return float(self.query(self.command))
+
+    def close(self):
+        """
+        Closes the socket connection
+        """
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+class SimulatedMeter(ReferenceMeter):
+    """
+    Simulated reference meter for unattended test runs without instrument. The
+    reading is <gain> * source() + <offset> with gaussian noise of standard
+    deviation <noise>.
+
+    source.. Function without arguments returning the true AC voltage, e.g. the
+             effective voltage measured with the INA260 power meter
+    seed.... Seed of the random number generator of the noise
+    """
+
+    def __init__(self, source, gain=1.0, offset=0.0, noise=0.0, seed=None): #pylint: disable=R0913
+        self.source = source
+        self.gain = gain
+        self.offset = offset
+        self.noise = noise
+        self.__random = random.Random(seed)
+
+    def read(self):
+        """
+        Returns one simulated reading
+        """
+        return self.gain * self.source() + self.offset + self.__random.gauss(0.0, self.noise)
+
+def open_meter(spec, source=None):
+    """
+    Creates a reference meter from the specification string <spec>:
+        manual............ ManualMeter
+        simulated......... SimulatedMeter of <source>
+        scpi://host[:port] SCPIMeter
+    """
+    if spec == "manual":
+        return ManualMeter()
+    if spec == "simulated":
+        assert source is not None, "Simulated meter needs a voltage source"
+        return SimulatedMeter(source)
+    if spec.startswith("scpi://"):
+        host, _, port = spec[len("scpi://"):].partition(":")
+        return SCPIMeter(host, int(port) if port else 5025)
+    raise ValueError("Unknown reference meter specification {}".format(spec))
@@ -0,0 +1,389 @@
+#pylint: disable=C0103,R0902
+"""
+Incremental analysis of the rectified mains voltage sampled with the INA260 power meter
+"""
+
+import collections
+from math import sqrt, asin, pi, floor
+import numpy as np #pylint: disable=E0401
+
+#Values of one completed period. <start> and <length> are given in seconds if the
+#samples have been fed with timestamps and in sample counts otherwise
+Period = collections.namedtuple('Period', ['start', 'length', 'samples', 'mean', 'rms'])
+
+class PeriodEstimator:
+    """
+    Streaming estimator for the per-period mean and RMS values of the rectified
+    mains voltage. A period starts at each rising crossing of <threshold>. Samples
+    can be fed one at a time with add() or in blocks with extend(). Only the sums
+    of the current period are kept, thus the memory is independent of the number
+    of samples. The incomplete period before the first crossing is dropped.
+
+    threshold. Level in Volts whose rising crossing starts a new period
+    scale..... Factor applied to the mean and RMS values of each period, e.g. sqrt(2)
+               to get the effective voltage from the single rectifier sensing circuit
+    callback.. Is called with the Period tuple of each completed period
+    """
+
+    def __init__(self, threshold=0.1, scale=1.0, callback=None):
+        self.__threshold = threshold
+        self.__scale = scale
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        """
+        Discards the current period and the running statistics
+        """
+        self.__last = None # Last sample value
+        self.__index = 0 # Total number of samples fed
+        self.__start = None # Start of current period
+        self.__n = 0
+        self.__sum = 0.0
+        self.__sumsq = 0.0
+        #Running statistics of the period means (Welford's algorithm)
+        self.__periods = 0
+        self.__mean = 0.0
+        self.__m2 = 0.0
+
+    @property
+    def periods(self):
+        """
+        Number of completed periods
+        """
+        return self.__periods
+
+    @property
+    def mean(self):
+        """
+        Running mean of the (scaled) mean values of all completed periods
+        """
+        return self.__mean if self.__periods > 0 else None
+
+    @property
+    def stderr(self):
+        """
+        Standard error of the running mean. Needs at least two completed periods
+        """
+        if self.__periods < 2:
+            return None
+        return sqrt(self.__m2 / (self.__periods - 1) / self.__periods)
+
+    def __crossing(self, start):
+        """
+        Handles a rising crossing at <start>. Closes the current period if there is one
+        and returns its Period tuple (None otherwise)
+        """
+        period = None
+        if self.__start is not None and self.__n > 0:
+            mean = self.__sum / self.__n * self.__scale
+            rms = sqrt(self.__sumsq / self.__n) * self.__scale
+            period = Period(self.__start, start - self.__start, self.__n, mean, rms)
+            self.__periods += 1
+            delta = mean - self.__mean
+            self.__mean += delta / self.__periods
+            self.__m2 += delta * (mean - self.__mean)
+            if self.callback is not None:
+                self.callback(period)
+        self.__start = start
+        self.__n = 0
+        self.__sum = 0.0
+        self.__sumsq = 0.0
+        return period
+
+    def add(self, value, timestamp=None):
+        """
+        Feeds a single sample <value> taken at <timestamp>. Returns the Period tuple
+        if the sample completed a period and None otherwise
+        """
+        period = None
+        if self.__last is not None and self.__last < self.__threshold < value:
+            period = self.__crossing(self.__index if timestamp is None else timestamp)
+        if self.__start is not None:
+            self.__n += 1
+            self.__sum += value
+            self.__sumsq += value * value
+        self.__last = value
+        self.__index += 1
+        return period
+
+    def extend(self, values, timestamps=None):
+        """
+        Feeds a block of samples <values> taken at <timestamps>. The crossings and the
+        sums are evaluated vectorized. Returns the list of Period tuples completed
+        by the block
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return []
+        previous = np.empty_like(values)
+        previous[0] = np.inf if self.__last is None else self.__last
+        previous[1:] = values[:-1]
+        crossings = np.flatnonzero((previous < self.__threshold) & (self.__threshold < values))
+        csum = np.concatenate(([0.0], np.cumsum(values)))
+        csumsq = np.concatenate(([0.0], np.cumsum(values * values)))
+        edges = [0] + crossings.tolist() + [values.size]
+        periods = []
+        for segment in range(len(edges) - 1):
+            first, stop = edges[segment], edges[segment + 1]
+            if segment > 0:
+                period = self.__crossing(self.__index + first if timestamps is None \
+                                         else float(timestamps[first]))
+                if period is not None:
+                    periods.append(period)
+            if self.__start is not None:
+                self.__n += stop - first
+                self.__sum += csum[stop] - csum[first]
+                self.__sumsq += csumsq[stop] - csumsq[first]
+        self.__last = values[-1]
+        self.__index += values.size
+        return periods
+
+class MainsTracker:
+    """
+    Tracks frequency and phase of the rectified mains voltage and predicts the
+    instants of future peaks and zero crossings. The rising crossings of <threshold>
+    are interpolated linearly between the enclosing samples and corrected to the
+    zero crossing of the sine using the peak value of the preceding period. The
+    zero crossing times drive a phase-locked estimator (alpha-beta loop) of the
+    reference zero crossing and the period. Crossings closer than half a period to
+    the last one are treated as noise and ignored.
+
+    nominal... Nominal mains frequency in Hz used until the loop has locked
+    threshold. Level in Volts of the crossing detection
+    alpha..... Loop gain of the phase correction
+    beta...... Loop gain of the period correction
+    lockcount. Number of consecutive crossings within a tenth of the period of
+               their prediction needed to signal lock
+    """
+
+    def __init__(self, nominal=50.0, threshold=0.1, alpha=0.3, beta=0.05, lockcount=3):
+        self.__nominal = nominal
+        self.__threshold = threshold
+        self.__alpha = alpha
+        self.__beta = beta
+        self.__lockcount = lockcount
+        self.reset()
+
+    def reset(self):
+        """
+        Drops the lock and restarts from the nominal frequency
+        """
+        self.__period = 1.0 / self.__nominal
+        self.__reference = None # Estimated time of last rising zero crossing
+        self.__lastvalue = None
+        self.__lasttime = None
+        self.__peak = 0.0 # Maximum of current period
+        self.__amplitude = None # Maximum of previous period
+        self.__matched = 0 # Number of consecutive crossings matching the prediction
+
+    @property
+    def frequency(self):
+        """
+        Estimated mains frequency in Hz
+        """
+        return 1.0 / self.__period
+
+    @property
+    def period(self):
+        """
+        Estimated mains period in seconds
+        """
+        return self.__period
+
+    @property
+    def amplitude(self):
+        """
+        Peak value of the last completed period
+        """
+        return self.__amplitude
+
+    @property
+    def locked(self):
+        """
+        True if the last <lockcount> crossings matched their prediction
+        """
+        return self.__matched >= self.__lockcount
+
+    def __crossing(self, crossing):
+        """
+        Updates the estimator with the threshold crossing at time <crossing>
+        """
+        period = self.__period
+        if self.__reference is not None and crossing - self.__reference < period / 2:
+            return
+        zerocrossing = crossing
+        if self.__peak > self.__threshold:
+            zerocrossing -= asin(self.__threshold / self.__peak) * period / (2 * pi)
+        self.__amplitude = self.__peak
+        self.__peak = 0.0
+        if self.__reference is None:
+            self.__reference = zerocrossing
+            return
+        elapsed = zerocrossing - self.__reference
+        cycles = max(round(elapsed / period), 1)
+        residual = elapsed - cycles * period
+        if abs(residual) > period / 4:
+            #Crossing far off the prediction, restart loop from this crossing
+            self.__reference = zerocrossing
+            self.__matched = 0
+            return
+        self.__reference += cycles * period + self.__alpha * residual
+        self.__period += self.__beta * residual / cycles
+        self.__matched = self.__matched + 1 if abs(residual) < period / 10 else 0
+
+    def add(self, value, timestamp):
+        """
+        Feeds a single sample <value> taken at <timestamp> in seconds
+        """
+        if self.__lastvalue is not None and self.__lastvalue < self.__threshold < value:
+            self.__crossing(self.__lasttime + (self.__threshold - self.__lastvalue) * \
+                            (timestamp - self.__lasttime) / (value - self.__lastvalue))
+        self.__peak = max(self.__peak, value)
+        self.__lastvalue = value
+        self.__lasttime = timestamp
+
+    def extend(self, values, timestamps):
+        """
+        Feeds a block of samples <values> taken at <timestamps>. The crossings are
+        detected and interpolated vectorized
+        """
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if values.size == 0:
+            return
+        previous = np.empty_like(values)
+        previoustimes = np.empty_like(timestamps)
+        previous[0] = np.inf if self.__lastvalue is None else self.__lastvalue
+        previoustimes[0] = timestamps[0] if self.__lasttime is None else self.__lasttime
+        previous[1:] = values[:-1]
+        previoustimes[1:] = timestamps[:-1]
+        indices = np.flatnonzero((previous < self.__threshold) & (self.__threshold < values))
+        crossings = previoustimes[indices] + (self.__threshold - previous[indices]) * \
+            (timestamps[indices] - previoustimes[indices]) / (values[indices] - previous[indices])
+        edges = [0] + indices.tolist() + [values.size]
+        for segment in range(len(edges) - 1):
+            if segment > 0:
+                self.__crossing(crossings[segment - 1])
+            if edges[segment + 1] > edges[segment]:
+                self.__peak = max(self.__peak, values[edges[segment]:edges[segment + 1]].max())
+        self.__lastvalue = values[-1]
+        self.__lasttime = timestamps[-1]
+
+    def phase(self, timestamp):
+        """
+        Returns the estimated phase in degrees (0..360) of the mains voltage at
+        <timestamp>, where 0 is the rising zero crossing and 90 the peak
+        """
+        assert self.__reference is not None, "No crossing detected yet"
+        return ((timestamp - self.__reference) / self.__period % 1.0) * 360.0
+
+    def next_instant(self, phase, after):
+        """
+        Returns the first time later than <after> at which the mains voltage reaches
+        the phase <phase> in degrees
+        """
+        assert self.__reference is not None, "No crossing detected yet"
+        instant = self.__reference + (phase % 360.0) / 360.0 * self.__period
+        instant += (floor((after - instant) / self.__period) + 1) * self.__period
+        #Rounding may yield <after> itself if it lies on an instant of <phase>
+        return instant if instant > after else instant + self.__period
+
+    def next_peak(self, after):
+        """
+        Returns the time of the first voltage peak later than <after>
+        """
+        return self.next_instant(90.0, after)
+
+    def next_zero_crossing(self, after, rising=True):
+        """
+        Returns the time of the first rising (falling if <rising> is False) zero
+        crossing later than <after>
+        """
+        return self.next_instant(0.0 if rising else 180.0, after)
+
+class SettleDetector:
+    """
+    Detects when the sampled voltage has settled after a switching event. The samples
+    are averaged over blocks of <interval> seconds, which should be a multiple of
+    the mains period to cancel the ripple of the rectified voltage. The voltage is
+    settled as soon as the last <window> block means have a standard deviation and
+    a linear trend (change of the least squares line over the window) both not
+    larger than <tolerance>.
+
+    interval.. Length of the averaging blocks in seconds
+    window.... Number of block means in the rolling window
+    tolerance. Maximum standard deviation and trend of the block means in Volts
+    """
+
+    def __init__(self, interval=0.02, window=5, tolerance=0.05):
+        assert window >= 2, "Window needs at least two block means"
+        self.__interval = interval
+        self.__tolerance = tolerance
+        self.__blocks = collections.deque(maxlen=window)
+        self.reset()
+
+    def reset(self):
+        """
+        Discards all samples and block means
+        """
+        self.__blocks.clear()
+        self.__start = None # Start of current block
+        self.__n = 0
+        self.__sum = 0.0
+        self.__settled = False
+
+    @property
+    def settled(self):
+        """
+        True if the block means in the window are within the tolerance
+        """
+        return self.__settled
+
+    @property
+    def value(self):
+        """
+        Mean of the block means in the window
+        """
+        if not self.__blocks:
+            return None
+        return sum(self.__blocks) / len(self.__blocks)
+
+    def __evaluate(self):
+        """
+        Checks standard deviation and trend of the block means in the window
+        """
+        if len(self.__blocks) < self.__blocks.maxlen:
+            return False
+        means = np.asarray(self.__blocks)
+        positions = np.arange(means.size) - (means.size - 1) / 2
+        slope = np.dot(positions, means) / np.dot(positions, positions)
+        return means.std(ddof=1) <= self.__tolerance and \
+            abs(slope) * (means.size - 1) <= self.__tolerance
+
+    def add(self, value, timestamp):
+        """
+        Feeds a single sample <value> taken at <timestamp> in seconds.
+        Returns True if the voltage is settled
+        """
+        if self.__start is None:
+            self.__start = timestamp
+        elif timestamp - self.__start >= self.__interval and self.__n > 0:
+            self.__blocks.append(self.__sum / self.__n)
+            self.__start += self.__interval * ((timestamp - self.__start) // self.__interval)
+            self.__n = 0
+            self.__sum = 0.0
+            self.__settled = self.__evaluate()
+        self.__n += 1
+        self.__sum += value
+        return self.__settled
+
+    def extend(self, values, timestamps):
+        """
+        Feeds a block of samples <values> taken at <timestamps>.
+        Returns True if the voltage is settled
+        """
+        for value, timestamp in zip(np.asarray(values, dtype=np.float64).tolist(), \
+                                    np.asarray(timestamps, dtype=np.float64).tolist()):
+            self.add(value, timestamp)
+        return self.__settled
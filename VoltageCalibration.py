@@ -4,57 +4,36 @@
 """
 Ramps Voltage automatically from 1.5V up to 30V with the 1A Coil configuration
 Then a shorter ramp from 1,5V up to 15V with the 2A Coil configuration is done
-At each voltage step the voltage measured with a multimeter at the output
-has to be entered and is compared to the internally measured value.
+At each voltage step the voltage measured with a reference meter at the output
+is compared to the internally measured value. The reference meter is given as
+first command line argument (manual, simulated or scpi://host[:port], default
+manual), the number of readings per step as second argument. The readings
+of non-interactive meters are taken concurrently with the internal measurement,
+the manual meter is read on the main thread after it.
 Finally the internal bus resistor value is calculated to minimize
 the deviation between internal and external measured voltage and these
 fit parameters are written into the default calibration parameter file
 ina260.json
 """
-import time
 import os
+import sys
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from math import sqrt
 import numpy as np
-from scipy.optimize import curve_fit
 from MCP23017 import MCP23017
+from VoltageLadder import ladder1A, ladder2A
 import INA260 #pylint: disable=E0401
-
-#Define voltage ladder one gets from the valid combination of the 3V, and 2x6V
-#secondary coils of the transformer for low current (1A) and the high current
-#(2A) option
-validV1A = []
-for i in range(10):
-    validV1A.append(1.5 * (i+1))
-for i in range(5):
-    validV1A.append(3.0 * (i+1) + validV1A[9])
-validV2A = []
-for i in range(6):
-    validV2A.append(1.5 * (i+1))
-for i in range(2):
-    validV2A.append(3.0 * (i+1) + validV2A[5])
-
-#Define the corresponding register settings for the required connections
-#for the above defined voltage ladder. The MSB byte is port A the LSB byte is port B
-reg1A = [0x0C06, 0x0C00, 0x1406, 0x1080, 0x2406, 0x1400, 0x9206, 0x2080, 0x6106, \
-         0x2400, 0x8900, 0x9200, 0x6200, 0x6100, 0xA100]
-dict1A = dict(zip(validV1A, reg1A))
-reg2A = [0x094E, 0x0948, 0x1156, 0x1218, 0x2166, 0x1150, 0x2228, 0x2160]
-dict2A = dict(zip(validV2A, reg2A))
+import Calibration
+from SignalAnalysis import SettleDetector
+from MainsSwitch import MainsSwitch
+from ReferenceMeter import open_meter
 
 voltages = []
+setpoint = 0.0
 
-def voltage2registers(voltage, highcurrent=False):
-    """
-    Converts the specified ac voltage in the tuple <allowed Vac>, <register a> and
-    <register b> and returns the values
-    """
-    #Limit voltage to allowed values. Take closest allowed value from validVxA lists
-    voltage = min(validV2A if highcurrent else validV1A, key=lambda x: abs(x-voltage))
-    regs = dict2A[voltage] if highcurrent else dict1A[voltage]
-    return voltage, regs >> 8, regs & 0xFF
-
-def switchsequence(portextender, powermeter, Vac, highcurrent=False):
+def switchsequence(portextender, powermeter, referencemeter, Vac, pool=None, nreadings=1, \
+                   highcurrent=False): #pylint: disable=R0913
     """
 
     Parameters
@@ -64,25 +43,36 @@ def switchsequence(portextender, powermeter, Vac, highcurrent=False):
         False then the register setting for 1A is returned
     portextender, powermeter : object
         Objects for the handling of the portextender and the powermeter respectively
+    referencemeter : ReferenceMeter
+        Meter delivering the external voltage readings
     Vac : Integer
         Specifies AC Voltage given by the definition of gpa and gpb ports.
+    pool : Executor
+        Executor taking the external readings concurrently to the internal
+        measurement. If None they are taken afterwards on the calling thread
+    nreadings : Integer
+        Number of external readings averaged per setpoint
 
     Returns
     -------
     None
     """
 
-    global voltages #pylint: disable=W0603
+    global setpoint #pylint: disable=W0603
 
-    #Get the required register settings for specified voltage Vac
-    Vac, gpa, gpb = voltage2registers(Vac, highcurrent=highcurrent)
-    #Set relais positions for required voltage and leave mains pin off
-    #Then switch on mains
-    portextender.setregister("gpioa", gpa)
-    portextender.setregister("gpiob", gpb)
+    #Switch relais positions from the previous setpoint to the required voltage
+    #with the minimal number of relais toggles. Mains is switched off at the voltage
+    #peak before relais are closed. Then switch on mains if still off
+    ladder = ladder2A if highcurrent else ladder1A
+    Vac = ladder.switch(portextender, Vac, mainsswitch=MainsSwitch(powermeter, portextender))
+    setpoint = Vac
     portextender.enable('Mains')
-    time.sleep(1.0)
-    #Readout on voltmeter, wait 1s to get voltage settled and to enable measurement integration
+    #Readout on voltmeter, wait up to 1s to get voltage settled and to enable
+    #measurement integration
+    powermeter.wait_for_settle(SettleDetector(), maxwait=1.0)
+    #Take the external readings concurrently to the internal measurement
+    if pool is not None:
+        extreadings = pool.submit(referencemeter.read_many, nreadings)
     #Since we have a single rectifier in the sensing circuit
     #The AC effective voltage measured is sqrt(2) times lower than the
     #effective voltage
@@ -96,18 +86,22 @@ def switchsequence(portextender, powermeter, Vac, highcurrent=False):
         effvoltage = powermeter.voltage() * sqrt(2)
         print("Voltage setting: {:4.1f}V ({:5.2f}V measured)".format(Vac, effvoltage))
         count += 1
-    extvoltage = input("Please enter external voltage reading:")
+    if pool is not None:
+        extvoltage = float(np.mean(extreadings.result()))
+    else:
+        extvoltage = float(np.mean(referencemeter.read_many(nreadings)))
+    print("External voltage reading: {:5.2f}V".format(extvoltage))
     voltages.append([Vac, effvoltage, extvoltage])
-    #Wait for voltage peak to minimize EMC when switching off mains
-    powermeter.wait_for_voltage_peak()
-    #Switch mains off
-    portextender.disable('Mains')
-    time.sleep(1.0)
-    portextender.setregister("gpioa", 0x00)
-    portextender.setregister("gpiob", 0x00)
-    time.sleep(1.0)
-#    portextender.reset()
-#    portextender.all_to_output()
+
+def switchoff(portextender, powermeter):
+    """
+    Switches mains off at a voltage peak and opens all relais
+    """
+    #Switch mains off at the voltage peak to minimize EMC
+    MainsSwitch(powermeter, portextender).off()
+    powermeter.wait_for_settle(SettleDetector(), maxwait=1.0)
+    portextender.write_ports(0x0000)
+    powermeter.wait_for_settle(SettleDetector(), maxwait=1.0)
 
 #create chip driver with bank=0 mode on address 0x20
 mcp23017 = MCP23017(i2cbus=1, device=0x20, bank=0, resetpin=4)
@@ -138,14 +132,27 @@ else:
     ina260 = INA260.INA260Controller(alertpin=13, avg=1024, vbusct=1100, ishct=140, meascont=True, \
                                      measi=False, measv=True, Rdiv1=Rdiv1, Rvbus=Rvbus, Vt=Vt)
 
+#The simulated reference meter reads the setpoint of the voltage ladder
+meterspec = sys.argv[1] if len(sys.argv) > 1 else "manual"
+readings = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+refmeter = open_meter(meterspec, source=lambda: setpoint)
+#Interactive meters prompt at the console, thus they are read on the main thread
+executor = None if refmeter.interactive else ThreadPoolExecutor(max_workers=1)
+
 print("Ramping Voltage from 1.5V up to 30V in 1A coil configuration")
-input("Press enter when ready....")
+if meterspec == "manual":
+    input("Press enter when ready....")
 
-for vac in validV1A:
-    switchsequence(mcp23017, ina260, vac, highcurrent=False)
+for vac in ladder1A.setpoints:
+    switchsequence(mcp23017, ina260, refmeter, vac, executor, readings, highcurrent=False)
+switchoff(mcp23017, ina260)
 print("Ramping Voltage from 1.5V up to 15V in 2A coil configuration")
-for vac in validV2A:
-    switchsequence(mcp23017, ina260, vac, highcurrent=True)
+for vac in ladder2A.setpoints:
+    switchsequence(mcp23017, ina260, refmeter, vac, executor, readings, highcurrent=True)
+switchoff(mcp23017, ina260)
+if executor is not None:
+    executor.shutdown()
+refmeter.close()
 
 with open("VoltageCalibration.csv","w") as f:
     wr = csv.writer(f)
@@ -155,29 +162,29 @@ del mcp23017
 
 print("End of Voltage Ramp")
 
-def fit_function(Vac, Vtm, Rvbusm):
-    """
-    Define fit function (See Mathematica Input deck SystemSimulation.nb)
-    """
-    global Rdiv1 #pylint: disable=W0603
-    global Rvbus #pylint: disable=W0603
-    global Vt #pylint: disable=W0603
-    return ((Rvbus * (Rdiv1 + Rvbusm) * (Vac - Vt))/((Rdiv1 + Rvbus) * Rvbusm) + Vtm) / Vac
-
-fitdata = np.array(voltages)
-
 fitdata = np.genfromtxt('VoltageCalibration.csv', delimiter=',')
 
-# Fit parameters are returned in popt as [Vtm, Rvbusm]
-# We drop the value for Vac=30V because it experience distortion due to input clamp
-
-np.delete(fitdata, np.where(fitdata[:,0]==30.), axis=0)
-xdata = fitdata[:,1]
-ydata = fitdata[:,2]/fitdata[:,1]
-popt, pcov = curve_fit(fit_function, xdata, ydata) # pylint: disable=W0632
-
-ina260.Vt = popt[0]
-ina260.Rvbus = popt[1]
+# Fit parameters Vt and Rvbus. Outliers and the points distorted by the input clamp
+# (e.g. Vac=30V) are rejected automatically. Unchanged datasets are not refitted
+#The model needs the parameters the internal readings have been taken with
+result = Calibration.fit(fitdata, ina260.Rdiv1, ina260.Rvbus, ina260.Vt, \
+                         cache='calibration_cache.json')
+for row in result.clamped:
+    print("Dropped {:4.1f}V setpoint distorted by input clamp".format(fitdata[row, 0]))
+for row in result.outliers:
+    print("Dropped {:4.1f}V setpoint as outlier".format(fitdata[row, 0]))
+
+#Per-tap correction of the residual deviation of the calibrated parameters
+#The factor of the active tap is selected in the meter by
+#VoltageLadder.switch(portextender, voltage, meter=ina260, taptable=taptable)
+taptable = Calibration.CorrectionTable(fitdata, [ladder1A, ladder2A], ina260.Rdiv1, \
+                                       ina260.Rvbus, ina260.Vt, calibrated=result, \
+                                       exclude=result.clamped + result.outliers)
+print("Writing per-tap correction table taptable.json")
+taptable.save('taptable.json')
+
+ina260.Vt = result.Vt
+ina260.Rvbus = result.Rvbus
 
 print("Calibrated Parameters: Vt={:7.5f}V, Rvbus={:6.3f}kOhm".format(ina260.Vt, ina260.Rvbus))
 print("Writing default configuration file ina260.json")
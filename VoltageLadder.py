@@ -0,0 +1,153 @@
+#pylint: disable=C0103
+# -*- coding: utf-8 -*-
+"""
+Voltage ladder of the transformer taps switched by the relay cards on the MCP23017
+port expander and planning of the relay sequences between its setpoints
+"""
+
+import time
+from bisect import bisect_left
+
+#Define voltage ladder one gets from the valid combination of the 3V, and 2x6V
+#secondary coils of the transformer for low current (1A) and the high current
+#(2A) option
+validV1A = [1.5 * (i+1) for i in range(10)] + [15.0 + 3.0 * (i+1) for i in range(5)]
+validV2A = [1.5 * (i+1) for i in range(6)] + [9.0 + 3.0 * (i+1) for i in range(2)]
+
+#Define the corresponding register settings for the required connections
+#for the above defined voltage ladder. The MSB byte is port A the LSB byte is port B
+reg1A = [0x0C06, 0x0C00, 0x1406, 0x1080, 0x2406, 0x1400, 0x9206, 0x2080, 0x6106, \
+         0x2400, 0x8900, 0x9200, 0x6200, 0x6100, 0xA100]
+reg2A = [0x094E, 0x0948, 0x1156, 0x1218, 0x2166, 0x1150, 0x2228, 0x2160]
+
+class VoltageLadder:
+    """
+    Setpoints of a voltage ladder and the relay words (MSB byte port A, LSB byte
+    port B) connecting the transformer taps for them. The nearest setpoint of a
+    voltage is found by bisection. For every pair of relay words (including the
+    word 0x0000 with all taps open) a break-before-make sequence is precomputed:
+    First the relays not needed by the target are opened, then the relays of the
+    target are closed. The intermediate word is a subset of the source and of the
+    target word, thus it can not connect coils in a way neither of them does, and
+    every relay toggles at most once, which is the minimum possible. switch() waits
+    for the release of the opened relays before it closes others and switches mains
+    off before it closes relays.
+    The pins in <mainsmask> are not part of the relay words and keep their state
+    when switching.
+
+    setpoints. List of the voltages of the ladder in ascending order
+    words..... List of the corresponding relay words
+    mainsmask. Bit mask of the pins switching the transformer primary side
+    """
+
+    def __init__(self, setpoints, words, mainsmask=0x0001):
+        assert len(setpoints) == len(words), "Each setpoint needs one relay word"
+        assert all(a < b for a, b in zip(setpoints, setpoints[1:])), \
+            "Setpoints must be in ascending order"
+        assert not any(word & mainsmask for word in words), \
+            "Relay words must not contain the mains pins"
+        self.__setpoints = list(setpoints)
+        self.__words = list(words)
+        self.__mainsmask = mainsmask
+        states = [0x0000] + self.__words
+        self.__plans = {(source, target): self.__plan(source, target) \
+                        for source in states for target in states}
+
+    @staticmethod
+    def __plan(source, target):
+        """
+        Returns the list of relay words switching from word <source> to word <target>
+        """
+        plan = []
+        if source & target != source:
+            plan.append(source & target)
+        if target != source & target:
+            plan.append(target)
+        return plan
+
+    @property
+    def setpoints(self):
+        """
+        List of the voltages of the ladder
+        """
+        return list(self.__setpoints)
+
+    def nearest(self, voltage):
+        """
+        Returns the setpoint closest to <voltage>
+        """
+        index = bisect_left(self.__setpoints, voltage)
+        if index == 0:
+            return self.__setpoints[0]
+        if index == len(self.__setpoints):
+            return self.__setpoints[-1]
+        below, above = self.__setpoints[index-1], self.__setpoints[index]
+        return below if voltage - below <= above - voltage else above
+
+    def word(self, voltage):
+        """
+        Returns the relay word of the setpoint closest to <voltage>
+        """
+        return self.__words[bisect_left(self.__setpoints, self.nearest(voltage))]
+
+    def registers(self, voltage):
+        """
+        Returns the tuple <setpoint>, <register a> and <register b> of the setpoint
+        closest to <voltage>
+        """
+        word = self.word(voltage)
+        return self.nearest(voltage), word >> 8, word & 0xFF
+
+    def plan(self, source, target):
+        """
+        Returns the list of relay words switching from relay word <source> to relay
+        word <target>. Mains pins are ignored
+        """
+        source &= ~self.__mainsmask
+        target &= ~self.__mainsmask
+        if (source, target) in self.__plans:
+            return self.__plans[(source, target)]
+        return self.__plan(source, target)
+
+    def switch(self, portextender, voltage, release=0.02, mainsswitch=None, meter=None, \
+               taptable=None): #pylint: disable=R0913
+        """
+        Switches the relays on <portextender> (MCP23017 object) from their current state
+        to the setpoint closest to <voltage> and returns the setpoint. If <voltage> is
+        None all taps are opened.
+        After each word opening relays the function waits <release> seconds for the
+        relays to break contact before the next write.
+        If the sequence closes a relay while mains is on, mains is switched off before
+        (by <mainsswitch> (MainsSwitch object) at the voltage peak if given, else
+        immediately) followed by the release time and stays off. Otherwise the mains
+        pins keep their state.
+        If <meter> (INA260Controller object) is given, its correction is set to the
+        factor of the new relay word in <taptable> (Calibration.CorrectionTable), or
+        cleared if there is no table or no factor for the word
+        """
+        current = portextender.ports
+        mains = current & self.__mainsmask
+        setpoint = None if voltage is None else self.nearest(voltage)
+        target = 0x0000 if voltage is None else self.word(voltage)
+        previous = current & ~self.__mainsmask
+        plan = self.plan(current, target)
+        if mains and target & ~previous:
+            if mainsswitch is not None:
+                mainsswitch.off()
+            else:
+                portextender.write_ports(previous)
+            time.sleep(release)
+            mains = 0x0000
+        for word in plan:
+            portextender.write_ports(word | mains)
+            if word & previous == word:
+                time.sleep(release)
+            previous = word
+        if meter is not None:
+            meter.correction = None if taptable is None else taptable[target]
+            if taptable is not None and meter.correction is None and target != 0x0000:
+                print("No correction factor for relay word 0x{:04X}".format(target))
+        return setpoint
+
+ladder1A = VoltageLadder(validV1A, reg1A)
+ladder2A = VoltageLadder(validV2A, reg2A)
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+#pylint: disable=C0103,E0401
+"""
+Test the calibration fit with the recorded voltage ramp VoltageCalibration.csv
+"""
+import json
+from math import isclose, sqrt
+import numpy as np
+import pytest
+import Calibration
+from VoltageLadder import ladder1A, ladder2A
+
+@pytest.fixture(name="ramp")
+def fixture_ramp():
+    """
+    Voltage ramp recorded with Rdiv1=220kOhm, Rvbus=211.8kOhm and Vt=0.1582257V
+    """
+    yield np.genfromtxt('VoltageCalibration.csv', delimiter=','), (220, 211.8, 0.1582257)
+
+def test_calibration_fit(ramp):
+    """
+    Test that the clamped 30V point is dropped and the fit is the least squares optimum
+    """
+    data, params = ramp
+    result = Calibration.fit(data, *params)
+    assert result.clamped == [14]
+    assert data[14, 0] == 30.0
+    assert not result.outliers
+    assert result.rms < 0.01
+    inliers = np.delete(data, result.clamped, axis=0)
+    def cost(Vtm, Rvbusm):
+        ratio = inliers[:, 2] / inliers[:, 1]
+        return np.sum((ratio - Calibration.model(inliers[:, 1], Vtm, Rvbusm, *params))**2)
+    optimum = cost(result.Vt, result.Rvbus)
+    for dVt, dRvbus in [(1e-3, 0), (-1e-3, 0), (0, 0.1), (0, -0.1)]:
+        assert cost(result.Vt + dVt, result.Rvbus + dRvbus) > optimum
+
+def test_calibration_outlier(ramp):
+    """
+    Test that a wrong reading inside the ramp is rejected as outlier
+    """
+    data, params = ramp
+    reference = Calibration.fit(data, *params)
+    data = data.copy()
+    data[5, 2] *= 1.05
+    result = Calibration.fit(data, *params)
+    assert result.outliers == [5]
+    assert result.clamped == [14]
+    assert isclose(result.Rvbus, reference.Rvbus, rel_tol=0.01)
+    #Too few rows can not be fitted
+    for rows in [data[:0], data[:2], data[0]]:
+        with pytest.raises(ValueError):
+            Calibration.fit(rows, *params)
+
+def test_calibration_cache(ramp, tmp_path):
+    """
+    Test that results of unchanged datasets are taken from the cache
+    """
+    data, params = ramp
+    cache = str(tmp_path / "calibration_cache.json")
+    result = Calibration.fit(data, *params, cache=cache)
+    with open(cache) as f:
+        results = json.load(f)
+    assert list(results.keys()) == [result.key]
+    #Modify cached entry to detect that no refit takes place
+    results[result.key]['Vt'] = 1.0
+    with open(cache, 'w') as f:
+        json.dump(results, f)
+    assert Calibration.fit(data, *params, cache=cache).Vt == 1.0
+    assert isclose(Calibration.fit(data[:-1], *params, cache=cache).Vt, result.Vt, rel_tol=0.1)
+
+def test_calibration_taptable(ramp, tmp_path):
+    """
+    Test that the per-tap correction reproduces the external readings at the taps
+    and is applied to the decoded voltage of the calibrated meter
+    """
+    data, params = ramp
+    result = Calibration.fit(data, *params)
+    taptable = Calibration.CorrectionTable(data, [ladder1A, ladder2A], *params, \
+                                           calibrated=result, exclude=result.clamped)
+    assert len(taptable.words) == len(data)
+    Rdiv1, Rvbus, Vt = params
+    #Internal readings as decoded by the meter with the calibrated parameters
+    internal = (data[:, 1] / sqrt(2) - Vt) * (Rvbus / (Rdiv1 + Rvbus)) / \
+        (result.Rvbus / (Rdiv1 + result.Rvbus)) + result.Vt
+    for row, (setpoint, _, external) in enumerate(data):
+        ladder = ladder1A if row < 15 else ladder2A
+        #The mains pin does not select another table
+        word = ladder.word(setpoint) | 0x0001
+        corrected = float(taptable.apply(word, internal[row])) * sqrt(2)
+        if row in result.clamped:
+            assert not isclose(corrected, external, rel_tol=0.01)
+        else:
+            assert isclose(corrected, external, rel_tol=1e-9)
+    assert taptable[0x0000] is None
+    filename = str(tmp_path / "taptable.json")
+    taptable.save(filename)
+    loaded = Calibration.CorrectionTable.load(filename)
+    assert sorted(loaded.words) == sorted(taptable.words)
+    assert loaded[0x2400] == taptable[0x2400]
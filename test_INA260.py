@@ -12,12 +12,14 @@ Created on Sat Aug 29 22:12:34 2020
 import time
 import os.path
 import json
+import asyncio
 from math import isclose, sqrt, floor, log10
-from statistics import mean, stdev
 import numpy as np #pylint: disable=E0401
 import pytest
 import INA260 #pylint: disable=E0401
+from INA260Sampler import INA260Sampler #pylint: disable=E0401
 from MCP23017 import MCP23017
+from SignalAnalysis import PeriodEstimator, SettleDetector #pylint: disable=E0401
 
 @pytest.fixture(name='mcp23017')
 def fixture_mcp23017():
@@ -76,6 +78,46 @@ def test_ina260_registeraccess(ina260):
     ina260.alertlimit = 0.002
     assert isclose(ina260.alertlimit, 0.002, abs_tol=0.00125) # absolute accuracy is 1.25mV/LSB thus we set this as tolerance
 
+def test_ina260_shadowregisters(ina260):
+    """
+    Test that the shadow copies of the configuration and mask/enable registers
+    track the device registers, also across a reset
+    """
+    ina260.verify = True
+    ina260.avg = 512
+    ina260.vbusct = 204
+    ina260.ishct = 204
+    ina260.meascont = False
+    ina260.measi = False
+    ina260.measv = True
+    assert ina260.configreg == 0x6C4A
+    ina260.reset()
+    assert ina260.configreg == 0x6127
+    #After the reset the shadow copy has to be read again from the device
+    ina260.avg = 1
+    assert ina260.configreg == 0x6127 & ~0x0E00
+    ina260.alert = ['Bus Voltage Over Voltage']
+    ina260.alertpol = 1
+    #Datasheet bit map of Mask/Enable: OCL D15, UCL D14, BOL D13, BUL D12, POL D11,
+    #CNVR D10, APOL D1, LEN D0
+    assert ina260.mask_enablereg & 0xFC03 == 0x2002
+    ina260.verify = False
+
+def test_ina260_configure(ina260):
+    """
+    Test changing all measurement settings with one write access into the
+    configuration register
+    """
+    ina260.reset()
+    #Set Averaging mode for 512 averages at 204us conversion time in trigger mode measuring only Bus Voltage
+    ina260.configure(avg=512, vbusct=204, ishct=204, meascont=False, measv=True, measi=False)
+    assert ina260.configreg == 0x6C4A
+    assert (ina260.avg, ina260.vbusct, ina260.ishct) == (512, 204, 204)
+    assert (ina260.meascont, ina260.measv, ina260.measi) == (False, True, False)
+    #Settings which are not specified are kept
+    ina260.configure(avg=1, meascont=True)
+    assert ina260.configreg == 0x604E
+
 def test_ina260_conversionreadyWithRegister(ina260):
     """
     Test conversion ready flag by using long conversion time and high amount of
@@ -219,6 +261,104 @@ def test_ina260_measurement(mcp23017, ina260):
     assert abs(effvoltage - 12.0) < 0.8
     print("Measurement done")
 
+def test_ina260_readall(mcp23017, ina260):
+    """
+    Test reading voltage, current and power in one combined I2C transaction
+    against the single register readouts
+    """
+    #Set all relais to provide 12.0V (without switching on mains yet)
+    mcp23017.setregister("gpioa", value=0x20)
+    mcp23017.setregister("gpiob", value=0x80)
+    #Use long averaging to get stable readings between the readouts
+    ina260.avg = 1024
+    ina260.vbusct = 1100
+    ina260.ishct = 1100
+    ina260.alert = ['Conversion Ready']
+    mcp23017.enable("Mains")
+    time.sleep(1.0)
+    assert ina260.wait_for_alert_edge(timeout='Automatic'), print("Timeout of conversion ready detection")
+    voltage, current, power = ina260.read_all()
+    assert isclose(voltage, ina260.voltage(), abs_tol=0.01)
+    assert isclose(current, ina260.current(), abs_tol=0.00125)
+    assert isclose(power, ina260.power(), abs_tol=0.01)
+    mcp23017.disable("Mains")
+    mcp23017.setregister("gpioa", value=0x00)
+    mcp23017.setregister("gpiob", value=0x00)
+
+def test_ina260_fastread(ina260):
+    """
+    Test polling the bus voltage register without resending the register pointer
+    and the resumption of the fast reads after accessing other registers
+    """
+    ina260.configure(avg=1024, vbusct=1100, measv=True, measi=False)
+    ina260.alert = ['Conversion Ready']
+    assert ina260.wait_for_alert_edge(timeout='Automatic'), print("Timeout of conversion ready detection")
+    reference = ina260.voltage()
+    with ina260.fastread(INA260.REG_BUS_VOLTAGE):
+        assert isclose(ina260.voltage(), reference, abs_tol=0.01)
+        assert ina260.manufacturer_id == 0x5449
+        assert isclose(ina260.voltage(), reference, abs_tol=0.01)
+        assert isclose(ina260.voltage(), reference, abs_tol=0.01)
+
+def test_ina260_decode(ina260):
+    """
+    Test vectorized conversion of raw register words against the single value
+    conversion
+    """
+    ina260.configure(avg=1024, vbusct=1100, ishct=1100, measv=True, measi=True)
+    ina260.alert = ['Conversion Ready']
+    assert ina260.wait_for_alert_edge(timeout='Automatic'), print("Timeout of conversion ready detection")
+    words = np.array([ina260.read_raw(INA260.REG_BUS_VOLTAGE)] * 3, dtype=np.uint16)
+    assert np.allclose(ina260.decode_voltage(words), ina260.voltage())
+    words = np.array([ina260.read_raw(INA260.REG_CURRENT)] * 3, dtype=np.uint16)
+    assert np.allclose(ina260.decode_current(words), ina260.current())
+    words = np.array([ina260.read_raw(INA260.REG_POWER)] * 3, dtype=np.uint16)
+    assert np.allclose(ina260.decode_power(words), ina260.power())
+    #Negative currents are given in two's complement
+    assert np.allclose(ina260.decode_current([0xFFFF, 0x8000, 0x0001]), \
+                       [-INA260.A_per_Bit, -32768 * INA260.A_per_Bit, INA260.A_per_Bit])
+    #The per-tap correction factor scales all decoded voltages alike
+    words = np.array([0x0000, 0x0800, 0x1000, 0x7FFF], dtype=np.uint16)
+    uncorrected = ina260.decode_voltage(words)
+    ina260.correction = 1.02
+    assert np.allclose(ina260.decode_voltage(words), uncorrected * 1.02)
+    ina260.correction = None
+    assert np.array_equal(ina260.decode_voltage(words), uncorrected)
+
+def test_ina260_fastcapture(ina260):
+    """
+    Test switching into the fast capture profile and the restore of the previous
+    settings, also when an exception is raised within the profile
+    """
+    ina260.configure(avg=1024, vbusct=1100, ishct=1100, meascont=True, measv=True, measi=True)
+    ina260.alert = ['Bus Voltage Over Voltage']
+    configreg = ina260.configreg
+    maskreg = ina260.mask_enablereg & 0xFC03
+    with ina260.fast_capture():
+        assert ina260.configreg == 0x6026
+        assert ina260.mask_enablereg & 0xFC03 == 0x0400
+        assert ina260.wait_for_alert_edge(timeout='Automatic'), print("Timeout of conversion ready detection")
+    assert ina260.configreg == configreg
+    assert ina260.mask_enablereg & 0xFC03 == maskreg
+    with pytest.raises(AssertionError):
+        with ina260.fast_capture():
+            assert False, "Exception within fast capture profile"
+    assert ina260.configreg == configreg
+    assert ina260.mask_enablereg & 0xFC03 == maskreg
+    assert (ina260.avg, ina260.vbusct, ina260.measi) == (1024, 1100, True)
+    assert ina260.alert == ['Bus Voltage Over Voltage']
+
+def test_ina260_settle(ina260):
+    """
+    Test settle detection on the bus voltage with mains switched off. The voltage
+    is constant, thus it has to settle after the window of block means has been filled
+    """
+    configreg = ina260.configreg
+    tstart = time.time()
+    assert ina260.wait_for_settle(SettleDetector(interval=0.02, window=5), maxwait=1.0)
+    assert 0.1 <= time.time() - tstart < 1.0
+    assert ina260.configreg == configreg
+
 def test_ina260_configio(ina260):
     """
     Test JSON Attribute writing and reading of INA260 Class
@@ -275,7 +415,7 @@ def test_ina260_sampling(mcp23017, ina260):
 
     ina260.alert = ['Conversion Ready']
 
-    count = n = 300
+    count = 300
     samples = []
 
     #Sample <count> measurements
@@ -285,27 +425,28 @@ def test_ina260_sampling(mcp23017, ina260):
 
         count -= 1
 
-    effective = []
-    startindex = 0
-    for i in range(len(samples)-1):
-        pair = samples[i:i+2]
-        if pair[0] < 0.1 < pair[1]:
-            #Calculate average of period between startindex from
-            #previous period and identified new startindex
-            average = np.trapz(samples[startindex:i]) / (i-startindex+1)
-            effective.append(average * sqrt(2))
-            startindex = i
-            print("Effective value: {:5.3f}V".format(effective[-1]))
-
-    #Calculate mean value over all measured periods but drop the
-    #incomplete first and last period
+    #Evaluate the effective value of each period. The incomplete periods before the
+    #first and after the last rising crossing are dropped by the estimator
+    estimator = PeriodEstimator(threshold=0.1, scale=sqrt(2), \
+                                callback=lambda period: print("Effective value: {:5.3f}V".\
+                                                              format(period.mean)))
+    estimator.extend(samples)
+
+    #Calculate mean value over all measured periods
     def round_to_1(x, ref=None):
         if ref is None:
             ref = x
         return round(x, -int(floor(log10(abs(ref)))))
 
-    error = sqrt((stdev(effective[1:-1]) ** 2)/n)
-    print("Mean effective value {}\u00B1{}V".format(round_to_1(mean(effective[1:-1]), ref=error), round_to_1(error)))
+    error = estimator.stderr
+    #The standard error needs at least two complete periods
+    if error:
+        print("Mean effective value {}\u00B1{}V".format(round_to_1(estimator.mean, ref=error), \
+                                                       round_to_1(error)))
+    elif estimator.mean is not None:
+        print("Mean effective value {:5.3f}V\u00B1n/a".format(estimator.mean))
+    else:
+        print("Mean effective value n/a (no complete period captured)")
 
     logfile = open(filename, 'w')
     logfile.writelines(map(lambda x: str(x)+'\n', samples))
@@ -318,3 +459,73 @@ def test_ina260_sampling(mcp23017, ina260):
     mcp23017.setregister("gpiob", value=0x00)
 
     print("Measurement done")
+
+def test_ina260_sampler(ina260):
+    """
+    Test background acquisition into the ring buffer of INA260Sampler
+    """
+    ina260.configure(avg=1, vbusct=140, measv=True, measi=False)
+    ina260.alert = ['Bus Voltage Under Voltage']
+    size = 200
+    with INA260Sampler(ina260, size=size) as sampler:
+        words, times = sampler.read(100, timeout=1.0)
+        assert len(words) == 100
+        assert words.dtype == np.uint16
+        assert np.all(np.diff(times) > 0), "Timestamps are not increasing"
+        #Let the acquisition overrun the ring buffer
+        time.sleep(4 * size * 140e-6 + 0.5)
+        assert sampler.count > size + 100
+        words, times = sampler.snapshot()
+        assert len(words) == size
+        words, times = sampler.read(10, timeout=1.0)
+        assert sampler.overruns > 0
+    assert not sampler.running
+    #The alert functions before the start are restored
+    assert ina260.alert == ['Bus Voltage Under Voltage']
+
+def test_ina260_sampler_concurrent(ina260):
+    """
+    Test that register accesses of the main thread while the sampler is running do not
+    make the sampler return the content of another register
+    """
+    ina260.configure(avg=1, vbusct=140, measv=True, measi=False)
+    configword = ina260.configreg
+    with INA260Sampler(ina260, size=2000) as sampler:
+        for _ in range(200):
+            assert ina260.configreg == configword
+            ina260.voltage()
+        words, _ = sampler.snapshot()
+    assert len(words) > 0
+    assert configword not in words
+
+def test_ina260_async(ina260):
+    """
+    Test waiting for the alert pin and streaming samples on an asyncio event loop
+    while another task keeps running on the same loop
+    """
+    ina260.configure(avg=4, vbusct=1100, measv=True, measi=True)
+    #The under voltage alert with zero limit never fires but has to survive the stream
+    ina260.alert = ['Conversion Ready', 'Bus Voltage Under Voltage']
+    alertmask = ina260.mask_enablereg & 0xFC00
+
+    async def measure():
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.001)
+                ticks += 1
+        task = asyncio.ensure_future(ticker())
+        assert await ina260.wait_for_alert(timeout='Automatic'), \
+            "Timeout of conversion ready detection"
+        samples = [sample async for sample in ina260.stream(count=20, timeout='Automatic')]
+        task.cancel()
+        return samples, ticks
+
+    samples, ticks = asyncio.run(measure())
+    assert len(samples) == 20
+    assert all(len(sample) == 4 for sample in samples)
+    #20 conversions of 4x2.2ms take about 180ms, the event loop must not have been blocked
+    assert ticks > 20, "Event loop blocked while waiting for samples"
+    assert ina260.alert == ['Conversion Ready', 'Bus Voltage Under Voltage']
+    assert ina260.mask_enablereg & 0xFC00 == alertmask
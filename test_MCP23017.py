@@ -50,6 +50,156 @@ def test_mcp23017_registeraccess(mcp23017):
     assert mcp23017.getregister("iodira") == 0x00
     assert mcp23017.getregister("iodirb") == 0x00
 
+def test_mcp23017_shadowregisters(mcp23017):
+    """
+    Test that pin operations on the shadow copies of IODIR, GPPU and OLAT
+    agree with the hardware registers
+    """
+    mcp23017.verify = True
+    mcp23017.all_to_output()
+    assert mcp23017.getregister("iodira") == 0x00
+    assert mcp23017.getregister("iodirb") == 0x00
+    #Writes into the GPIO registers end up in the OLAT registers
+    mcp23017.enable(port="a", bit=3)
+    mcp23017.enable(port="b", bit=5)
+    assert mcp23017.getregister("olata") == 0x08
+    assert mcp23017.getregister("olatb") == 0x20
+    #Enabling an already enabled pin must not change anything
+    mcp23017.enable(port="a", bit=3)
+    assert mcp23017.getregister("olata") == 0x08
+    mcp23017.disable(port="a", bit=3)
+    mcp23017.disable(port="b", bit=5)
+    assert mcp23017.getregister("gpioa") == 0x00
+    assert mcp23017.getregister("gpiob") == 0x00
+    mcp23017.setinput("Mains")
+    assert mcp23017.getregister(register="iodir", pin="Mains") == 1
+    assert mcp23017.getregister(register="gppu", pin="Mains") == 1
+    #Changes behind the back of the driver are picked up by resync
+    mcp23017.bus.write_byte_data(mcp23017.device, mcp23017.registeraddr("olata"), 0x81)
+    mcp23017.resync()
+    mcp23017.enable(port="a", bit=1)
+    assert mcp23017.getregister("olata") == 0x83
+    mcp23017.all_to_input()
+    mcp23017.verify = False
+
+def test_mcp23017_writeports(mcp23017):
+    """
+    Test writing both output latches with one 16-bit word
+    """
+    mcp23017.verify = True
+    mcp23017.all_to_output()
+    for word in [0x0C06, 0x9206, 0xA100, 0x2160, 0x0000]:
+        mcp23017.write_ports(word)
+        assert mcp23017.ports == word
+        assert mcp23017.getregister("olata") == word >> 8
+        assert mcp23017.getregister("olatb") == word & 0xFF
+    #Single pin operations act on the latches written by write_ports
+    mcp23017.write_ports(0x1406)
+    mcp23017.enable("Mains")
+    assert mcp23017.ports == 0x1407
+    mcp23017.write_ports(0x0000)
+    mcp23017.all_to_input()
+    mcp23017.verify = False
+
+def test_mcp23017_setpins(mcp23017):
+    """
+    Test switching several pins by name at once
+    """
+    mcp23017.verify = True
+    mcp23017.set_pins({"Mains": 1, "C2M": 1, "A2AC1": 1})
+    assert mcp23017.getregister(register="iodir", pin="Mains") == 0
+    assert mcp23017.getregister(register="iodir", pin="A2AC1") == 0
+    assert mcp23017.getregister("iodira") == 0xFE
+    assert mcp23017.getregister("olatb") == 0x11
+    assert mcp23017.getregister("olata") == 0x01
+    mcp23017.set_pins({"Mains": 0, "C2M": 1})
+    assert mcp23017.getregister("olatb") == 0x10
+    assert mcp23017.getregister(register="gpio", pin="A2AC1") == 1
+    mcp23017.set_pins({name: 0 for name in ["Mains", "C2M", "A2AC1"]})
+    assert mcp23017.ports == 0x0000
+    mcp23017.all_to_input()
+    mcp23017.verify = False
+
+def test_mcp23017_interrupts(mcp23017):
+    """
+    Test the interrupt configuration registers for interrupt on change and
+    interrupt on difference to a compare value
+    """
+    mcp23017.add_interrupt("Mains", callback=lambda name, value: None)
+    assert mcp23017.getregister(register="iodir", pin="Mains") == 1
+    assert mcp23017.getregister(register="gpinten", pin="Mains") == 1
+    assert mcp23017.getregister(register="intcon", pin="Mains") == 0
+    mcp23017.add_interrupt(port="a", bit=2, callback=lambda name, value: None, compare=1)
+    assert mcp23017.getregister("gpintena") == 0x04
+    assert mcp23017.getregister("intcona") == 0x04
+    assert mcp23017.getregister("defvala") == 0x04
+    mcp23017.remove_interrupt("Mains")
+    mcp23017.remove_interrupt(port="a", bit=2)
+    assert mcp23017.getregister("gpintena") == 0x00
+    assert mcp23017.getregister("gpintenb") == 0x00
+
+def test_mcp23017_interruptdispatch(mcp23017):
+    """
+    Test that a flagged interrupt is dispatched to the callback of its pin with the
+    captured pin value and that the dispatch clears the interrupt
+    """
+    calls = []
+    def record(name, value):
+        calls.append((name, value))
+    mcp23017.setinput("Mains")
+    value = mcp23017.value("Mains")
+    #Interrupt on difference to the inverted pin value is flagged at once
+    mcp23017.add_interrupt("Mains", callback=record, compare=1-value)
+    assert mcp23017.getregister(register="intf", pin="Mains") == 1
+    assert mcp23017.dispatch_interrupts() == ["Mains"]
+    assert calls == [("Mains", value)]
+    #After disabling the interrupt the dispatch has cleared the flag for good
+    mcp23017.remove_interrupt("Mains")
+    assert mcp23017.dispatch_interrupts() == []
+    assert mcp23017.getregister(register="intf", pin="Mains") == 0
+    assert calls == [("Mains", value)]
+
+def test_mcp23017_snapshot(mcp23017):
+    """
+    Test checkpointing and restoring all registers
+    """
+    mcp23017.write_ports(0x1406)
+    mcp23017.set_pins({"L2AC1": 1, "D2N": 0})
+    mcp23017.setinput("K2AC1")
+    data = mcp23017.snapshot()
+    assert len(data) == 22
+    assert data[mcp23017.registeraddr("olata")] == 0x14
+    assert data[mcp23017.registeraddr("iodirb")] == 0x5F
+    mcp23017.all_to_output()
+    mcp23017.write_ports(0x0000)
+    mcp23017.restore(data)
+    assert mcp23017.ports == 0x1486
+    assert mcp23017.snapshot()[:mcp23017.registeraddr("intfa")] == \
+        data[:mcp23017.registeraddr("intfa")]
+    mcp23017.write_ports(0x0000)
+    mcp23017.all_to_input()
+
+def test_mcp23017_attach(mcp23017):
+    """
+    Test attaching a second driver instance to the running port expander
+    without changing the pin states
+    """
+    mcp23017.all_to_output()
+    mcp23017.write_ports(0x1406)
+    #A previous owner might have left IOCON.SEQOP set which disables the
+    #address increment of the attach snapshot
+    mcp23017.enable_bit(mcp23017.gpioa["iocon"], 5)
+    attached = MCP23017(i2cbus=1, device=0x20, bank=0, resetpin=4, attach=True)
+    assert attached.ports == 0x1406
+    assert attached.getregister("iodira") == 0x00
+    assert attached.getregister("olatb") == 0x06
+    assert attached.getregister("iocona") & 0x20 == 0
+    attached.enable("Mains")
+    assert mcp23017.getregister("olatb") == 0x07
+    del attached
+    mcp23017.write_ports(0x0000)
+    mcp23017.all_to_input()
+
 def test_mcp23017_relaisswitching(mcp23017):
     """
     Demo how to access Relais cards through MCP23017 port expander
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+#pylint: disable=C0103,E0401
+"""
+Test switching mains synchronized to the mains voltage waveform
+"""
+import pytest
+import INA260
+from MCP23017 import MCP23017
+from MainsSwitch import MainsSwitch
+from SignalAnalysis import SettleDetector
+from VoltageLadder import ladder1A
+
+@pytest.fixture(name='mcp23017')
+def fixture_mcp23017():
+    """
+    create chip driver with bank=0 mode on address 0x20, reset it to initialize
+    via GPIO pin 4 of Raspi and set all pins to output
+    """
+    portexpander = MCP23017(i2cbus=1, device=0x20, bank=0, resetpin=4)
+    portexpander.all_to_output()
+    yield portexpander
+    portexpander.write_ports(0x0000)
+    del portexpander
+
+@pytest.fixture(name="ina260")
+def fixture_ina260():
+    """
+    Initialize I2C Bus #1 for INA260 with address 0x40 measuring the bus voltage
+    """
+    meter = INA260.INA260Controller(alertpin=13, avg=1, vbusct=140, ishct=140, meascont=True, \
+                                     measi=False, measv=True, Rdiv1=220)
+    yield meter
+    del meter
+
+def test_mainsswitch(mcp23017, ina260):
+    """
+    Test switching mains off at the voltage peak and on again at the zero crossing
+    """
+    mainsswitch = MainsSwitch(ina260, mcp23017)
+    #Without phase estimate mains is switched on immediately
+    ladder1A.switch(mcp23017, 3.0)
+    result = mainsswitch.on()
+    assert result.target is None and result.error is None
+    assert mcp23017.value("Mains") == 1
+    ina260.wait_for_settle(SettleDetector(), maxwait=1.0)
+    assert mainsswitch.track(duration=0.2), "Mains phase could not be locked"
+    assert 45.0 < mainsswitch.tracker.frequency < 65.0
+    result = mainsswitch.off()
+    print("Switched off at {:.1f} degrees".format(result.phase))
+    #The write has to be completed within 1ms (18 degrees at 50Hz) of its schedule
+    assert abs(result.written - (result.target - mainsswitch.latency)) < 0.001
+    assert 0.0 < mainsswitch.transfer < 0.002
+    assert mcp23017.value("Mains") == 0
+    result = mainsswitch.on()
+    print("Switched on at {:.1f} degrees".format(result.phase))
+    assert abs(result.written - (result.target - mainsswitch.latency)) < 0.001
+    assert mcp23017.value("Mains") == 1
+    mainsswitch.off()
@@ -83,6 +83,35 @@ def test_OLEDDisplay_Pattern(OLEDDisplay):
     OLEDDisplay.Display_Image(image)
     time.sleep(2.0)
 
+def test_OLEDDisplay_RGB565():
+    """
+    Compare the vectorized RGB565 conversion with the conversion of single pixels
+    """
+    image = Image.new("RGB", (128, 128), "BLACK")
+    draw = ImageDraw.Draw(image)
+    for i in range(0, 128):
+        draw.line([(i, 0), (i, 127)], fill=(2*i, 255 - 2*i, (7*i) % 256), width=1)
+    data = OLED.rgb888_to_rgb565(image).tobytes()
+    pixels = image.load()
+    for x, y in [(0, 0), (5, 17), (64, 100), (127, 127)]:
+        red, green, blue = pixels[x, y]
+        assert data[(y*128 + x)*2] == (red & 0xF8) | (green >> 5)
+        assert data[(y*128 + x)*2 + 1] == ((green << 3) & 0xE0) | (blue >> 3)
+
+def test_OLEDDisplay_FrameRate(OLEDDisplay):
+    """
+    Measure the frame rate of full frame transfers
+    """
+    images = [Image.new("RGB", (OLEDDisplay.w, OLEDDisplay.h), color) \
+              for color in ["RED", "GREEN", "BLUE"]]
+    frames = 30
+    start = time.perf_counter()
+    for i in range(frames):
+        OLEDDisplay.Display_Image(images[i % len(images)])
+    rate = frames / (time.perf_counter() - start)
+    print("Frame rate {:.1f} frames/s".format(rate))
+    assert rate > 5.0
+
 def test_OLEDDisplay_Text(OLEDDisplay):
     """
     Display Test Text
@@ -124,6 +153,42 @@ def test_OLEDDisplay_Menu(OLEDDisplay):
 
     time.sleep(0.5)
 
+def test_OLEDDisplay_Framebuffer(OLEDDisplay):
+    """
+    Display Menu Text with partial updates of the framebuffer
+    """
+    image = Image.new("RGB", (OLEDDisplay.w, OLEDDisplay.h), "BLACK")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.truetype('cambriab.ttf', 16)
+
+    menu = ['Menu Line '+str(i) for i in range(5)]
+    for idx, line in enumerate(menu):
+        width, height = font.getsize(line)
+        draw.text((OLEDDisplay.w-width,12+idx*height), line, fill="BLUE", font=font)
+    OLEDDisplay.Display_Image(image)
+    assert OLEDDisplay.dirty_rectangles() == []
+
+    for sel in range(1, len(menu)):
+        width, height = font.getsize(menu[sel])
+        draw.rectangle([(0, 12+sel*height), (OLEDDisplay.w-1, 12+(sel+1)*height-1)], fill="WHITE")
+        draw.text((OLEDDisplay.w-width,12+sel*height), menu[sel], fill="BLUE", font=font)
+        OLEDDisplay.Update_Image(image)
+        rectangles = OLEDDisplay.flush()
+        #Only the rows of the selected line have been transferred
+        assert len(rectangles) == 1
+        _, y0, _, y1 = rectangles[0]
+        assert 12+sel*height <= y0 and y1 < 12+(sel+1)*height
+        assert OLEDDisplay.flush() == []
+        time.sleep(0.5)
+        #Restore the line before selecting the next one
+        draw.rectangle([(0, 12+sel*height), (OLEDDisplay.w-1, 12+(sel+1)*height-1)], fill="BLACK")
+        draw.text((OLEDDisplay.w-width,12+sel*height), menu[sel], fill="BLUE", font=font)
+        OLEDDisplay.Update_Image(image)
+        assert OLEDDisplay.flush() == rectangles
+
+    OLEDDisplay.invalidate()
+    assert OLEDDisplay.flush() == [(0, 0, OLEDDisplay.w-1, OLEDDisplay.h-1)]
+
 @pytest.mark.interactive
 def test_OLEDDisplay_Menu_Encoder(OLEDDisplay, InputDevices, suspend_capturing):
     """
@@ -170,7 +235,9 @@ def test_OLEDDisplay_Menu_Encoder(OLEDDisplay, InputDevices, suspend_capturing):
         for idx, line in enumerate(lines):
             width, height = font.getsize(line)
             draw.text((x0, y0 + idx*height), line, fill=color, font=font)
-        OLEDDisplay.Display_Image(image)
+        #Transfer only the menu lines changed by the new selection
+        OLEDDisplay.Update_Image(image)
+        OLEDDisplay.flush()
 
     def get_menu_nodename(parent, sel):
         return menu.children(parent)[sel].identifier
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+#pylint: disable=C0103,E0401
+"""
+Test the reference meter backends without instrument
+"""
+import socketserver
+import threading
+from statistics import mean, stdev
+import pytest
+from ReferenceMeter import ReferenceMeter, ManualMeter, SCPIMeter, SimulatedMeter, open_meter
+
+class SCPIHandler(socketserver.StreamRequestHandler):
+    """
+    Answers the AC voltage query with a fixed reading and counts the queries
+    """
+    queries = 0
+
+    def handle(self):
+        for line in self.rfile:
+            if line.strip() == b"MEAS:VOLT:AC?":
+                SCPIHandler.queries += 1
+                self.wfile.write(b"+1.23450000E+01\n")
+            else:
+                self.wfile.write(b"-113,\"Undefined header\"\n")
+
+@pytest.fixture(name="scpiserver")
+def fixture_scpiserver():
+    """
+    SCPI socket server on a free local port
+    """
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SCPIHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_scpimeter(scpiserver):
+    """
+    Test SCPI readings over one socket connection
+    """
+    host, port = scpiserver.server_address
+    SCPIHandler.queries = 0
+    with open_meter("scpi://{}:{}".format(host, port)) as meter:
+        assert isinstance(meter, SCPIMeter)
+        assert meter.read() == 12.345
+        assert meter.read_many(4) == [12.345] * 4
+        assert meter.query("*IDN?").startswith("-113")
+    assert SCPIHandler.queries == 5
+
+def test_simulatedmeter():
+    """
+    Test gain, offset and noise of the simulated meter
+    """
+    meter = SimulatedMeter(lambda: 10.0, gain=1.01, offset=0.05, noise=0.02, seed=1)
+    readings = meter.read_many(1000)
+    assert abs(mean(readings) - 10.15) < 0.005
+    assert abs(stdev(readings) - 0.02) < 0.005
+    assert open_meter("simulated", source=lambda: 3.0).read() == 3.0
+    with pytest.raises(ValueError):
+        open_meter("dmm")
+    #The base class can not be instantiated without read()
+    with pytest.raises(TypeError):
+        ReferenceMeter() #pylint: disable=E0110
+
+def test_manualmeter(monkeypatch):
+    """
+    Test that invalid console input is asked again
+    """
+    answers = iter(["", "12,3", "12.3"])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+    assert ManualMeter().read() == 12.3
+    assert ManualMeter.interactive and not SimulatedMeter.interactive
@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+#pylint: disable=C0103,E0401
+"""
+Test analysis of the rectified mains voltage with synthetic sample data
+"""
+from math import sqrt, pi, isclose
+import numpy as np
+import pytest
+from SignalAnalysis import PeriodEstimator, MainsTracker, SettleDetector
+
+@pytest.fixture(name='rectified')
+def fixture_rectified():
+    """
+    Half-wave rectified 50Hz sine with 17V amplitude sampled every 140us
+    over 10 periods starting in the negative half-wave
+    """
+    times = np.arange(0.0, 0.2, 140e-6)
+    values = np.maximum(17.0 * np.sin(2 * pi * 50.0 * times + pi), 0.0)
+    yield times, values
+
+def test_periodestimator_values(rectified):
+    """
+    Test per-period mean, RMS and length against the analytical values
+    """
+    times, values = rectified
+    estimator = PeriodEstimator(threshold=0.1)
+    periods = estimator.extend(values, times)
+    #The incomplete period before the first crossing and the last open period are dropped
+    assert len(periods) == 9
+    for period in periods:
+        assert isclose(period.length, 0.02, abs_tol=140e-6)
+        assert isclose(period.mean, 17.0 / pi, rel_tol=0.01)
+        assert isclose(period.rms, 17.0 / 2, rel_tol=0.01)
+    assert estimator.periods == 9
+    assert isclose(estimator.mean, 17.0 / pi, rel_tol=0.01)
+    assert estimator.stderr < 0.01
+
+def test_periodestimator_blocks(rectified):
+    """
+    Test that feeding single samples and blocks of arbitrary size yield the same results
+    """
+    times, values = rectified
+    single = PeriodEstimator(scale=sqrt(2))
+    reference = [period for period in (single.add(v, t) for v, t in zip(values, times)) \
+                 if period is not None]
+    published = []
+    blocks = PeriodEstimator(scale=sqrt(2), callback=published.append)
+    periods = []
+    for start in range(0, len(values), 97):
+        periods += blocks.extend(values[start:start+97], times[start:start+97])
+    assert periods == published
+    assert len(periods) == len(reference)
+    for period, ref in zip(periods, reference):
+        assert period.samples == ref.samples
+        assert isclose(period.start, ref.start)
+        assert isclose(period.mean, ref.mean)
+        assert isclose(period.rms, ref.rms)
+    assert isclose(blocks.mean, single.mean)
+
+def test_mainstracker_prediction():
+    """
+    Test frequency estimation and peak prediction on a noisy rectified sine with
+    off-nominal frequency, arbitrary phase and jittered sampling instants
+    """
+    rng = np.random.default_rng(1)
+    frequency = 49.8
+    phase = 0.7
+    times = np.cumsum(rng.uniform(130e-6, 160e-6, 5000))
+    values = np.maximum(17.0 * np.sin(2 * pi * frequency * times + phase), 0.0) + \
+        rng.normal(0.0, 0.01, times.size)
+    tracker = MainsTracker(nominal=50.0)
+    tracker.extend(values, times)
+    assert tracker.locked
+    assert isclose(tracker.frequency, frequency, abs_tol=0.05)
+    assert isclose(tracker.amplitude, 17.0, abs_tol=0.1)
+    #Next true peak after the last sample is at 2*pi*f*t + phase = pi/2 + 2*pi*k
+    after = times[-1]
+    cycle = np.ceil(frequency * after - (0.25 - phase / (2 * pi)))
+    peak = (cycle + 0.25 - phase / (2 * pi)) / frequency
+    assert abs(tracker.next_peak(after) - peak) < 100e-6
+    assert tracker.next_peak(after) > after
+    zerophase = tracker.phase(tracker.next_zero_crossing(after))
+    assert min(zerophase, 360.0 - zerophase) < 1e-6
+    assert isclose(tracker.phase(tracker.next_zero_crossing(after, rising=False)), 180.0)
+    #An instant of the requested phase itself yields the following one
+    peak = tracker.next_peak(after)
+    assert isclose(tracker.next_peak(peak) - peak, tracker.period)
+
+def test_mainstracker_blocks():
+    """
+    Test that feeding single samples and blocks yield the same estimate
+    """
+    times = np.arange(0.0, 0.3, 140e-6)
+    values = np.maximum(17.0 * np.sin(2 * pi * 50.3 * times + 1.0), 0.0)
+    single = MainsTracker()
+    for value, timestamp in zip(values, times):
+        single.add(value, timestamp)
+    blocks = MainsTracker()
+    for start in range(0, len(values), 113):
+        blocks.extend(values[start:start+113], times[start:start+113])
+    assert isclose(single.frequency, blocks.frequency)
+    assert isclose(single.next_peak(times[-1]), blocks.next_peak(times[-1]))
+
+def test_settledetector():
+    """
+    Test settling of a rectified sine with exponentially approaching amplitude
+    """
+    times = np.arange(0.0, 1.0, 140e-6)
+    amplitude = 17.0 * (1.0 - 0.5 * np.exp(-times / 0.05))
+    values = np.maximum(amplitude * np.sin(2 * pi * 50.0 * times), 0.0)
+    detector = SettleDetector(interval=0.02, window=5, tolerance=0.05)
+    settletime = None
+    for value, timestamp in zip(values, times):
+        if detector.add(value, timestamp):
+            settletime = timestamp
+            break
+    #The block means settle within a few time constants of the amplitude
+    assert settletime is not None and 0.25 < settletime < 0.5
+    assert isclose(detector.value, 17.0 / pi, rel_tol=0.01)
+    detector.reset()
+    assert not detector.settled
+    assert detector.extend(values[times > 0.5], times[times > 0.5])
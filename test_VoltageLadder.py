@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+#pylint: disable=C0103,E0401
+"""
+Test setpoint lookup and relay sequence planning of the VoltageLadder class
+"""
+import pytest
+from VoltageLadder import VoltageLadder, ladder1A, ladder2A, validV1A, reg1A
+
+class PortRecorder:
+    """
+    Records the relay words written through write_ports. If <log> is given the
+    writes are appended to it as ("write", word) as well
+    """
+    def __init__(self, ports=0x0000, log=None):
+        self.ports = ports
+        self.writes = []
+        self.log = log
+
+    def write_ports(self, word):
+        """
+        Records <word> as new state of the ports
+        """
+        self.ports = word
+        self.writes.append(word)
+        if self.log is not None:
+            self.log.append(("write", word))
+
+class MainsRecorder:
+    """
+    Records switching mains off through the MainsSwitch interface
+    """
+    def __init__(self, ports, log):
+        self.ports = ports
+        self.log = log
+
+    def off(self):
+        """
+        Clears the mains pin of the recorded ports
+        """
+        self.ports.ports &= ~0x0001
+        self.log.append(("mains off", self.ports.ports))
+
+@pytest.fixture(name="log")
+def fixture_log(monkeypatch):
+    """
+    Log of the port writes with the sleeps of the ladder in between
+    """
+    log = []
+    monkeypatch.setattr("VoltageLadder.time.sleep", lambda delay: log.append(("sleep", delay)))
+    yield log
+
+def test_voltageladder_nearest():
+    """
+    Test nearest setpoint lookup against a linear search
+    """
+    for voltage in [0.0, 1.0, 1.5, 2.2, 2.3, 14.9, 16.0, 16.6, 29.0, 45.0]:
+        assert ladder1A.nearest(voltage) == min(validV1A, key=lambda x: abs(x-voltage))
+    assert ladder1A.registers(16.0) == (15.0, 0x24, 0x00)
+    assert ladder2A.word(100.0) == 0x2160
+    with pytest.raises(AssertionError):
+        VoltageLadder([3.0, 1.5], [0x0C06, 0x0C00])
+
+@pytest.mark.parametrize("ladder", [ladder1A, ladder2A])
+def test_voltageladder_plans(ladder):
+    """
+    Test that all planned sequences are break-before-make and toggle each relay
+    at most once
+    """
+    words = [0x0000] + [ladder.word(setpoint) for setpoint in ladder.setpoints]
+    for source in words:
+        for target in words:
+            plan = ladder.plan(source, target)
+            assert (plan[-1] if plan else source) == target
+            previous = source
+            for word in plan:
+                #each step either only opens or only closes relays
+                assert word & previous in [word, previous]
+                #no relay is closed which neither source nor target needs
+                assert word & ~(source | target) == 0
+                previous = word
+            toggles = sum(bin(a ^ b).count("1") for a, b in zip([source] + plan, plan))
+            assert toggles == bin(source ^ target).count("1")
+
+@pytest.mark.usefixtures("log")
+def test_voltageladder_switch():
+    """
+    Test switching the ladder keeps the mains pin when only opening relays, switches
+    mains off before closing relays and skips unneeded writes
+    """
+    ports = PortRecorder(reg1A[0] | 0x0001)
+    assert ladder1A.switch(ports, 3.0) == 3.0
+    #0x0C06 -> 0x0C00 only opens relays
+    assert ports.writes == [0x0C01]
+    assert ladder1A.switch(ports, 3.1) == 3.0
+    assert ports.writes == [0x0C01]
+    assert ladder1A.switch(ports, 4.5) == 4.5
+    assert ports.writes == [0x0C01, 0x0C00, 0x0400, 0x1406]
+    ports.write_ports(ports.ports | 0x0001)
+    assert ladder1A.switch(ports, None) is None
+    assert ports.ports == 0x0001
+
+def test_voltageladder_switch_sequence(log):
+    """
+    Test the order of the writes and the release time after each word opening relays
+    """
+    ports = PortRecorder(0x0C00 | 0x0001, log)
+    ladder1A.switch(ports, 4.5, release=0.03)
+    #Mains off, break 0x0C00 -> 0x0400, make 0x1406
+    assert log == [("write", 0x0C00), ("sleep", 0.03), ("write", 0x0400), ("sleep", 0.03), \
+                   ("write", 0x1406)]
+    ports.write_ports(0x1406 | 0x0001)
+    del log[:]
+    ladder1A.switch(ports, 3.0, release=0.03, mainsswitch=MainsRecorder(ports, log))
+    assert log == [("mains off", 0x1406), ("sleep", 0.03), ("write", 0x0400), ("sleep", 0.03), \
+                   ("write", 0x0C00)]
+    #Opening relays only keeps mains on and waits for the release
+    ports.write_ports(0x0C06 | 0x0001)
+    del log[:]
+    ladder1A.switch(ports, 3.0, release=0.03)
+    assert log == [("write", 0x0C01), ("sleep", 0.03)]
+
+class TapFactors(dict):
+    """
+    Correction factors by relay word, None for words without factor
+    """
+    def __missing__(self, word):
+        return None
+
+class MeterRecorder:
+    """
+    Power meter with correction attribute
+    """
+    correction = 1.5
+
+@pytest.mark.usefixtures("log")
+def test_voltageladder_correction():
+    """
+    Test that switching selects the correction factor of the new tap
+    """
+    ports = PortRecorder()
+    meter = MeterRecorder()
+    taptable = TapFactors({0x1406: 1.01, 0x0C00: 0.99})
+    ladder1A.switch(ports, 4.5, meter=meter, taptable=taptable)
+    assert meter.correction == 1.01
+    ladder1A.switch(ports, 3.0, meter=meter, taptable=taptable)
+    assert meter.correction == 0.99
+    ladder1A.switch(ports, 6.0, meter=meter, taptable=taptable)
+    assert meter.correction is None
+    ladder1A.switch(ports, 3.0, meter=meter)
+    assert meter.correction is None
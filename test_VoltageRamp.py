@@ -10,7 +10,11 @@ import os
 from math import sqrt
 import pytest
 from MCP23017 import MCP23017
+from VoltageLadder import ladder1A, ladder2A
 import INA260 #pylint: disable=E0401
+from Calibration import CorrectionTable
+from SignalAnalysis import SettleDetector
+from MainsSwitch import MainsSwitch
 
 @pytest.fixture(name='mcp23017')
 def fixture_mcp23017():
@@ -60,60 +64,19 @@ def fixture_ina260():
 
     del meter
 
-@pytest.fixture(name='MCP23017Regs1A')
-def fixture_MCP23017Regs1A():
+@pytest.fixture(name="taptable")
+def fixture_taptable():
     """
-    #Define voltage ladder one gets from the valid combination of the 3V, and 2x6V
-    #secondary coils of the transformer for low current (1A) option
+    Per-tap correction factors from the file taptable.json (if existing) which has
+    been generated by the calibration script VoltageCalibration.py
     """
+    if os.path.isfile('taptable.json'):
+        print("Reading per-tap correction table taptable.json")
+        yield CorrectionTable.load('taptable.json')
+    else:
+        yield None
 
-    validV1A = []
-    for i in range(10):
-        validV1A.append(1.5 * (i+1))
-    for i in range(5):
-        validV1A.append(3.0 * (i+1) + validV1A[9])
-
-    #Define the corresponding register settings for the required connections
-    #for the above defined voltage ladder. The MSB byte is port A the LSB byte is port B
-    reg1A = [0x0C06, 0x0C00, 0x1406, 0x1080, 0x2406, 0x1400, 0x9206, 0x2080, 0x6106, \
-             0x2400, 0x8900, 0x9200, 0x6200, 0x6100, 0xA100]
-    dict1A = dict(zip(validV1A, reg1A))
-
-    yield dict1A
-    del dict1A
-
-@pytest.fixture(name='MCP23017Regs2A')
-def fixture_MCP23017Regs2A():
-    """
-    #Define voltage ladder one gets from the valid combination of the 3V, and 2x6V
-    #secondary coils of the transformer for the high current (2A) option
-    """
-
-    validV2A = []
-    for i in range(6):
-        validV2A.append(1.5 * (i+1))
-    for i in range(2):
-        validV2A.append(3.0 * (i+1) + validV2A[5])
-
-    #Define the corresponding register settings for the required connections
-    #for the above defined voltage ladder. The MSB byte is port A the LSB byte is port B
-    reg2A = [0x094E, 0x0948, 0x1156, 0x1218, 0x2166, 0x1150, 0x2228, 0x2160]
-    dict2A = dict(zip(validV2A, reg2A))
-    yield dict2A
-    del dict2A
-
-def voltage2registers(voltage, vdict):
-    """
-    Converts the specified ac voltage in the tuple <allowed Vac>, <register a> and
-    <register b> using the specified dictionary for high or low current
-    configuration and returns the values.
-    """
-    #Limit voltage to allowed values. Take closest allowed value from validVxA lists
-    voltage = min(list(vdict.keys()), key=lambda x: abs(x-voltage))
-    regs = vdict[voltage]
-    return voltage, regs >> 8, regs & 0xFF
-
-def switchsequence(portextender, powermeter, Vac, vdict):
+def switchsequence(portextender, powermeter, Vac, ladder, taptable=None):
     """
 
     Parameters
@@ -125,8 +88,10 @@ def switchsequence(portextender, powermeter, Vac, vdict):
         Objects for the handling of the portextender and the powermeter respectively
     Vac : Integer
         Specifies AC Voltage given by the definition of gpa and gpb ports.
-    vdict : Dictionary
-        Specifies a dictionary of the register settings needed for a given voltage.
+    ladder : VoltageLadder
+        Specifies the voltage ladder with the register settings needed for a given voltage.
+    taptable : CorrectionTable
+        Per-tap correction factors selected in the powermeter, None for no correction
 
     Returns
     -------
@@ -134,15 +99,16 @@ def switchsequence(portextender, powermeter, Vac, vdict):
 
     """
 
-    #Get the required register settings for specified voltage Vac
-    Vac, gpa, gpb = voltage2registers(Vac, vdict)
-    #Set relais positions for required voltage and leave mains pin off
-    #Then switch on mains
-    portextender.setregister("gpioa", gpa)
-    portextender.setregister("gpiob", gpb)
+    #Switch relais positions from the previous setpoint to the required voltage
+    #with the minimal number of relais toggles. Mains is switched off at the voltage
+    #peak before relais are closed. Then switch on mains if still off
+    #The correction factor of the new tap is selected in the power meter
+    Vac = ladder.switch(portextender, Vac, mainsswitch=MainsSwitch(powermeter, portextender), \
+                        meter=powermeter, taptable=taptable)
     portextender.enable('Mains')
-    time.sleep(1.0)
-    #Readout on voltmeter, wait 1s to get voltage settled and to enable measurement integration
+    #Readout on voltmeter, wait up to 1s to get voltage settled and to enable
+    #measurement integration
+    powermeter.wait_for_settle(SettleDetector(), maxwait=1.0)
     #Since we have a single rectifier in the sensing circuit
     #The AC effective voltage measured is sqrt(2) times lower than the
     #effective voltage
@@ -156,35 +122,38 @@ def switchsequence(portextender, powermeter, Vac, vdict):
         effvoltage = powermeter.voltage() * sqrt(2)
         print("Voltage setting: {:4.1f}V ({:5.2f}V measured)".format(Vac, effvoltage))
         count += 1
-    #Wait for voltage peak to minimize EMC when switching off mains
-    powermeter.wait_for_voltage_peak()
-    #Switch mains off
-    portextender.disable('Mains')
-    time.sleep(1.0)
-    portextender.setregister("gpioa", 0x00)
-    portextender.setregister("gpiob", 0x00)
-    time.sleep(1.0)
-#    portextender.reset()
-#    portextender.all_to_output()
 
-def test_VoltageRamp_1A(mcp23017, ina260, MCP23017Regs1A):
+def switchoff(portextender, powermeter):
+    """
+    Switches mains off at a voltage peak and opens all relais
+    """
+    #Switch mains off at the voltage peak to minimize EMC
+    MainsSwitch(powermeter, portextender).off()
+    powermeter.wait_for_settle(SettleDetector(), maxwait=1.0)
+    portextender.write_ports(0x0000)
+    powermeter.correction = None
+    powermeter.wait_for_settle(SettleDetector(), maxwait=1.0)
+
+def test_VoltageRamp_1A(mcp23017, ina260, taptable):
     """
     Test Voltage Ramp from 1.5V up to 30V in 1A coil configuration
     """
     print("Ramping Voltage from 1.5V up to 30V in 1A coil configuration")
     time.sleep(1.0)
-    for vac in list(MCP23017Regs1A.keys()):
-        switchsequence(mcp23017, ina260, vac, MCP23017Regs1A)
+    for vac in ladder1A.setpoints:
+        switchsequence(mcp23017, ina260, vac, ladder1A, taptable)
+    switchoff(mcp23017, ina260)
 
     print("End of 1A Coil Voltage Ramp")
 
-def test_VoltageRamp_2A(mcp23017, ina260, MCP23017Regs2A):
+def test_VoltageRamp_2A(mcp23017, ina260, taptable):
     """
     Test Voltage Ramp from 1.5V up to 30V in 1A coil configuration
     """
     print("Ramping Voltage from 1.5V up to 15V in 2A coil configuration")
     time.sleep(1.0)
-    for vac in list(MCP23017Regs2A.keys()):
-        switchsequence(mcp23017, ina260, vac, MCP23017Regs2A)
+    for vac in ladder2A.setpoints:
+        switchsequence(mcp23017, ina260, vac, ladder2A, taptable)
+    switchoff(mcp23017, ina260)
 
     print("End of 2A Coil Voltage Ramp")
@@ -72,19 +72,20 @@ def test_supplyDisturbanceMains(mcp23017, ina260):
 
     ina260.alert = ['Conversion Ready']
 
-    #Start measurements by taking three initial samples
-    samples = []
-    for _ in range(3):
-        ina260.wait_for_alert_edge(timeout='Automatic')
-        samples.append(ina260.voltage())
-    #Detect maximum by checking if successive differences of the last three
-    #voltage samples change their sign from positive to negative
-    #Furthermore ensure that the readings are larger than 1V to prevent
-    #trigger through noise
-    while not (samples[-1]-samples[-2] < 0 < samples[-2]-samples[-3] and\
-               all(s>1.0 for s in samples[-3:])):
-        ina260.wait_for_alert_edge(timeout='Automatic')
-        samples.append(ina260.voltage())
+    with ina260.fastread(INA260.REG_BUS_VOLTAGE):
+        #Start measurements by taking three initial samples
+        samples = []
+        for _ in range(3):
+            ina260.wait_for_alert_edge(timeout='Automatic')
+            samples.append(ina260.voltage())
+        #Detect maximum by checking if successive differences of the last three
+        #voltage samples change their sign from positive to negative
+        #Furthermore ensure that the readings are larger than 1V to prevent
+        #trigger through noise
+        while not (samples[-1]-samples[-2] < 0 < samples[-2]-samples[-3] and\
+                   all(s>1.0 for s in samples[-3:])):
+            ina260.wait_for_alert_edge(timeout='Automatic')
+            samples.append(ina260.voltage())
 
     mcp23017.disable("Mains")
 